@@ -0,0 +1,95 @@
+"""
+Compressed input benchmark for csv_processor and sqlite_builder
+
+Generates a synthetic raw export, stores it plain and gzip/xz/zstd
+compressed, and times convert_csv and a bulk sqlite_builder load on each
+format. Bytes read are counted from /proc/self/io where available, so the
+numbers show the I/O saved against the extra CPU spent decompressing.
+
+Usage: python -m benchmarks.compression [rows] [--formats FORMAT ...]
+"""
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from compressed_io import open_stream
+from csv_processor import convert_csv
+from sqlite_builder import bulk_load_database
+from benchmarks.synthetic import generate_csv
+
+# File extension per format; '' is the uncompressed baseline
+FORMATS = {'plain': '', 'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+ROWS = 100000
+
+def bytes_read():
+    """Bytes this process has read through system calls, or None off Linux"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def run_stage(func, *args):
+    """
+    Run one stage quietly in a fresh process and return (seconds, bytes read)
+    """
+    before = bytes_read()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    seconds = time.perf_counter() - start
+    after = bytes_read()
+    return seconds, None if before is None else after - before
+
+def isolated(func, *args):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_stage, func, *args).result()
+
+def compress(source, target):
+    with open(source, 'rb') as src, open_stream(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def megabytes(value):
+    return f"{value / 1e6:9.1f}" if value is not None else f"{'n/a':>9}"
+
+def run(rows=ROWS, formats=tuple(FORMATS)):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_csv = os.path.join(tmp_dir, 'raw.csv')
+        generate_csv(raw_csv, rows)
+
+        print(f"{'format':8} {'stage':8} {'file MB':>9} {'read MB':>9} {'seconds':>8}")
+        for fmt in formats:
+            extension = FORMATS[fmt]
+            raw_input = raw_csv + extension
+            utf8_csv = os.path.join(tmp_dir, f'utf8.csv{extension}')
+            db_file = os.path.join(tmp_dir, f'{fmt}.sqlite')
+            if extension:
+                compress(raw_csv, raw_input)
+
+            for stage, func, input_file, args in [
+                ('convert', convert_csv, raw_input, (raw_input, utf8_csv)),
+                ('build', bulk_load_database, utf8_csv, (utf8_csv, db_file)),
+            ]:
+                seconds, read = isolated(func, *args)
+                print(f"{fmt:8} {stage:8} {megabytes(os.path.getsize(input_file))} "
+                      f"{megabytes(read)} {seconds:8.2f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark compressed CSV input and output")
+    parser.add_argument('rows', type=int, nargs='?', default=ROWS,
+                        help=f"synthetic rows to generate (default {ROWS})")
+    parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS),
+                        help="formats to compare (zstd needs the zstandard package)")
+    args = parser.parse_args()
+
+    run(args.rows, args.formats)
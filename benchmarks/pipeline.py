@@ -0,0 +1,223 @@
+"""
+Synthetic-scale benchmark for the CSV-to-SQLite pipeline
+
+Generates synthetic regulation exports of the requested sizes, runs
+csv_processor.convert_csv and a sqlite_builder build on each, and appends
+throughput, peak RSS, database size and index build time to a JSON
+history. Each run is compared with the median of the last runs of the same
+size and build mode, and the command exits with status 1 when a time, peak
+RSS or size grew by more than --max-regression.
+
+Usage: python -m benchmarks.pipeline [--rows N ...] [--modes MODE ...] [--history FILE]
+                                     [--max-regression FRACTION]
+"""
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import sqlite_builder
+from csv_processor import convert_csv
+from benchmarks.synthetic import generate_csv
+
+BUILDERS = {
+    'rowwise': sqlite_builder.create_database,
+    'bulk': sqlite_builder.bulk_load_database,
+    'stream': sqlite_builder.stream_database,
+    'parallel': sqlite_builder.parallel_load_database,
+    # Loads the raw export directly, so its build time includes conversion
+    'raw': functools.partial(sqlite_builder.stream_database, raw=True),
+}
+
+HISTORY_FILE = 'bench_history.json'
+
+# Number of earlier runs whose median a run is compared with
+BASELINE_RUNS = 5
+
+# Growth over the baseline that counts as a regression
+MAX_REGRESSION = 0.25
+
+# (section, key) of the result values checked for regressions
+CHECKED_METRICS = [
+    ('build', 'seconds'),
+    ('build', 'peak_rss_mb'),
+    ('build', 'db_bytes'),
+    ('convert', 'seconds'),
+    ('convert', 'peak_rss_mb'),
+]
+
+def run_stage(func, *args):
+    """
+    Run one pipeline stage quietly and return (result, seconds, peak RSS MB).
+    Called in a freshly spawned process, not a fork of the benchmark, so the
+    peak RSS belongs to this stage alone.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args)
+    return result, time.perf_counter() - start, sqlite_builder.peak_memory_mb()
+
+def isolated(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_stage, func, *args).result()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(rows, mode, tmp_dir):
+    raw_csv = os.path.join(tmp_dir, f'raw_{rows}.csv')
+    utf8_csv = os.path.join(tmp_dir, f'utf8_{rows}.csv')
+    db_file = os.path.join(tmp_dir, f'{mode}_{rows}.sqlite')
+
+    if not os.path.exists(raw_csv):
+        generate_csv(raw_csv, rows)
+    if not os.path.exists(utf8_csv):
+        _, convert_seconds, convert_rss = isolated(convert_csv, raw_csv, utf8_csv)
+    else:
+        convert_seconds = convert_rss = None
+
+    source_csv = raw_csv if mode == 'raw' else utf8_csv
+    stats, build_seconds, build_rss = isolated(BUILDERS[mode], source_csv, db_file)
+
+    conn = sqlite3.connect(db_file)
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    conn.close()
+
+    return {
+        'rows': rows,
+        'mode': mode,
+        'csv_bytes': os.path.getsize(raw_csv),
+        'convert': None if convert_seconds is None else {
+            'seconds': round(convert_seconds, 3),
+            'rows_per_sec': round(rows / convert_seconds),
+            'peak_rss_mb': round(convert_rss, 1),
+        },
+        'build': {
+            'seconds': round(build_seconds, 3),
+            'rows_per_sec': round(rows / build_seconds),
+            'index_seconds': round(stats['index_seconds'], 3),
+            'derived_seconds': {name: round(seconds, 3) for name, seconds in stats['derived_seconds'].items()},
+            'peak_rss_mb': round(build_rss, 1),
+            'db_bytes': os.path.getsize(db_file),
+            'db_pages': page_count,
+        },
+    }
+
+def metric(result, path):
+    section, key = path
+    return (result.get(section) or {}).get(key)
+
+def baseline(history, rows, mode, runs=BASELINE_RUNS):
+    """
+    Median of each checked metric over the last runs results of the same
+    size and build mode, so one noisy run does not move the baseline
+    """
+    previous = [result for run in history for result in run['results']
+                if result['rows'] == rows and result['mode'] == mode][-runs:]
+    medians = {}
+    for path in CHECKED_METRICS:
+        values = [metric(result, path) for result in previous if metric(result, path) is not None]
+        if values:
+            medians[path] = statistics.median(values)
+    return medians
+
+def change(current, previous):
+    if not previous:
+        return ''
+    return f" ({(current - previous) / previous:+.0%})"
+
+def regressions(result, medians, max_regression):
+    """Descriptions of the checked metrics that grew by more than max_regression"""
+    found = []
+    for path, previous in medians.items():
+        current = metric(result, path)
+        if current is not None and previous and (current - previous) / previous > max_regression:
+            found.append(f"{result['rows']:,} rows {result['mode']}: {'.'.join(path)} "
+                         f"{previous:,.3f} -> {current:,.3f}{change(current, previous)}")
+    return found
+
+def print_result(result, medians):
+    build = result['build']
+    print(f"{result['rows']:>10,} rows  {result['mode']:8}  "
+          f"build {build['seconds']:8.2f}s{change(build['seconds'], medians.get(('build', 'seconds')))}  "
+          f"{build['rows_per_sec']:>9,} rows/s  index {build['index_seconds']:7.2f}s  "
+          f"rss {build['peak_rss_mb']:7.1f} MB{change(build['peak_rss_mb'], medians.get(('build', 'peak_rss_mb')))}  "
+          f"db {build['db_bytes'] / 1e6:8.1f} MB")
+    derived = build.get('derived_seconds')
+    if derived:
+        print(f"{'':10}       {'derived':8}  " + '  '.join(f"{name} {seconds:.2f}s" for name, seconds in derived.items()))
+    convert = result['convert']
+    if convert:
+        print(f"{'':10}       {'convert':8}  {'':6}{convert['seconds']:8.2f}s"
+              f"{change(convert['seconds'], medians.get(('convert', 'seconds')))}  "
+              f"{convert['rows_per_sec']:>9,} rows/s  {'':15}  rss {convert['peak_rss_mb']:7.1f} MB")
+
+def run(row_counts, modes, history_file=HISTORY_FILE, max_regression=MAX_REGRESSION):
+    """
+    Run the benchmarks and append them to the history. Returns the
+    regressions found against the baseline of earlier runs.
+    """
+    history = []
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+
+    results = []
+    found = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in row_counts:
+            for mode in modes:
+                result = benchmark(rows, mode, tmp_dir)
+                medians = baseline(history, rows, mode)
+                print_result(result, medians)
+                found += regressions(result, medians, max_regression)
+                results.append(result)
+
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'results': results,
+    })
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+    print(f"Results appended to {history_file}")
+
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    return found
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark the CSV-to-SQLite pipeline on synthetic data")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help="synthetic row counts to run, e.g. 10000 1000000 10000000")
+    parser.add_argument('--modes', nargs='+', choices=list(BUILDERS), default=['bulk'],
+                        help="sqlite_builder build modes to run (default bulk)")
+    parser.add_argument('--history', default=HISTORY_FILE,
+                        help=f"JSON history file to append to (default {HISTORY_FILE})")
+    parser.add_argument('--max-regression', type=float, default=MAX_REGRESSION,
+                        help=f"growth over the median of the last {BASELINE_RUNS} runs that fails the "
+                             f"benchmark (default {MAX_REGRESSION})")
+    args = parser.parse_args()
+
+    if run(args.rows, args.modes, args.history, args.max_regression):
+        sys.exit(1)
@@ -0,0 +1,112 @@
+"""
+Query-plan regression benchmark for regulations.sqlite
+
+Builds a database from the CSV scaled up by repeating its rows, asserts that
+EXPLAIN QUERY PLAN for each read query uses the expected index, and records
+the median latency of each query.
+
+Usage: python -m benchmarks.query_plans input.csv [scale]
+"""
+import csv
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from sqlite_builder import bulk_load_database, ENTITY_TABLES
+from regulation_queries import (ENTITIES_FOR_SERVICE_SQL, SERVICES_FOR_ENTITY_SQL,
+                                FILTER_BY_STATUS_AND_LEVEL_SQL, SERVICE_OVERVIEW_SQL, RELATED_SQL)
+
+SCALE = 100
+
+def scale_csv(csv_file, output_file, scale):
+    """
+    Write csv_file repeated scale times, with navn made unique per copy
+    """
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for copy in range(scale):
+            for row in rows:
+                writer.writerow(dict(row, navn=f"{row['navn']} ({copy})"))
+
+def query_plan(conn, sql, params):
+    """
+    Return the EXPLAIN QUERY PLAN detail lines for a query
+    """
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+def median_latency_ms(conn, sql, params, runs=50):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def run(csv_file, scale=SCALE):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scaled_csv = os.path.join(tmp_dir, 'scaled.csv')
+        db_file = os.path.join(tmp_dir, 'scaled.sqlite')
+        scale_csv(csv_file, scaled_csv, scale)
+        bulk_load_database(scaled_csv, db_file)
+
+        conn = sqlite3.connect(db_file)
+        service = conn.execute('SELECT name FROM samhandlingstjeneter ORDER BY id LIMIT 1').fetchone()[0]
+        entity_id = conn.execute('SELECT MIN(id) FROM reguleringer').fetchone()[0]
+        levels = len(ENTITY_TABLES)
+        related_rows = conn.execute('SELECT COUNT(*) FROM relaterte_entiteter').fetchone()[0]
+        assert related_rows, "relaterte_entiteter is empty"
+
+        # (name, sql, params, indexes the plan must use)
+        cases = [
+            ('entities_for_service', ENTITIES_FOR_SERVICE_SQL, (service,),
+             ['idx_koblinger_tjeneste']),
+            ('services_for_entity', SERVICES_FOR_ENTITY_SQL, (entity_id, 'regulering'),
+             ['sqlite_autoindex_koblinger_1']),
+            ('filter_by_status', FILTER_BY_STATUS_AND_LEVEL_SQL[(True, False)],
+             ('Eksisterer',) * levels,
+             ['idx_reguleringer_status', 'idx_komponenter_status']),
+            ('filter_by_status_and_level', FILTER_BY_STATUS_AND_LEVEL_SQL[(True, True)],
+             ('Under utvikling', 'Semantisk') * levels,
+             ['idx_reguleringer_status', 'idx_komponenter_status']),
+            ('service_overview', SERVICE_OVERVIEW_SQL, (service,),
+             ['SEARCH o USING PRIMARY KEY']),
+            ('related_entities', RELATED_SQL, ('regulering', entity_id, 10),
+             ['SEARCH r USING PRIMARY KEY']),
+        ]
+
+        failures = []
+        for name, sql, params, indexes in cases:
+            plan = query_plan(conn, sql, params)
+            missing = [index for index in indexes if not any(index in line for line in plan)]
+            latency = median_latency_ms(conn, sql, params)
+            rows = len(conn.execute(sql, params).fetchall())
+            status = 'ok' if not missing else f"MISSING {', '.join(missing)}"
+            print(f"{name:28} {rows:7} rows  {latency:8.3f} ms  {status}")
+            if missing:
+                failures.append((name, plan))
+
+        conn.close()
+
+    for name, plan in failures:
+        print(f"\nQuery plan for {name}:")
+        for line in plan:
+            print(f"  {line}")
+
+    assert not failures, f"{len(failures)} queries did not use their expected index"
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python -m benchmarks.query_plans input.csv [scale]")
+        sys.exit(1)
+
+    run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else SCALE)
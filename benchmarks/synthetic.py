@@ -0,0 +1,149 @@
+"""
+Synthetic regulation exports for benchmarking
+
+Generates CSVs shaped like the raw regulation report: the same columns,
+cp1252 encoding, Norwegian text, multi-valued samhandlingstjenester and the
+value mix of the real export.
+
+Usage: python -m benchmarks.synthetic output.csv rows [seed]
+"""
+import csv
+import random
+
+RAW_COLUMNS = [
+    'informasjonstype', 'navn', 'ingress', 'beskrivelse', 'kontekstavhengig_beskrivelse',
+    'normeringsniva', 'eif_niva', 'status', 'samhandlingstjenester', 'ansvarlig',
+    'dokumenttype', 'referanse_lenketekst', 'referanse_url'
+]
+
+# Value frequencies taken from regulation_report.csv. informasjonstype keeps
+# the trailing space the export adds.
+INFORMASJONSTYPER = {
+    'Kodeverk og terminologi ': 40, 'Krav og prinsipper ': 36, 'Samhandlingskomponent ': 12,
+    'Informasjonsmodell ': 9, 'Faktaark ': 8, 'Teknisk grensesnitt ': 7, 'Forskrift ': 7,
+    'Lov ': 6, 'Informasjonstjeneste ': 4, 'Teknisk samhandlingsform ': 4, 'Veileder ': 4,
+    'Nasjonal e-helseløsning ': 3, 'Arbeidsprosess ': 2, 'Informasjonslager ': 2,
+    'Fortolkning ': 2, 'Organisatorisk samhandlingsform ': 2, 'Klinisk fagsystem ': 1,
+}
+EIF_NIVAER = {
+    'Semantisk': 55, 'Teknisk': 30, 'Organisatorisk': 23, 'Juridisk': 15, '': 7,
+    'Organisatorisk, Teknisk': 7, 'Organisatorisk, Semantisk': 6,
+    'Organisatorisk, Semantisk, Teknisk': 4, 'Semantisk, Teknisk': 2,
+}
+STATUSER = {'Eksisterer': 133, 'Under utvikling': 11, '': 4, 'Udekkede behov': 1}
+NORMERINGSNIVAER = {
+    '': 124, 'Nasjonale faglige råd': 13, 'Anbefalt standard': 5,
+    'Obligatorisk standard': 4, 'Nasjonal veileder': 3,
+}
+ANSVARLIGE = {
+    'Helsedirektoratet': 68, 'Norsk helsenett (NHN)': 39, 'Normen': 12,
+    'Helse- og omsorgsdepartementet': 11, 'EU-kommisjonen': 4,
+    'Integrating the Healthcare Enterprise (IHE)': 4, 'Det enkelte samarbeidsområdet': 4,
+    'Direktoratet for medisinske produkter': 3, 'Helfo': 1, 'Legemiddelverket': 1,
+    'Justis- og beredskapsdepartementet': 1, 'Den enkelte aktør': 1,
+}
+# Number of samhandlingstjenester per row
+SERVICE_COUNTS = {1: 110, 2: 15, 3: 5, 4: 6, 5: 13}
+
+# Every MANY_SERVICES_EVERY rows one links MANY_SERVICES services, as
+# overview documents covering a whole area do
+MANY_SERVICES = 24
+MANY_SERVICES_EVERY = 10000
+
+SERVICES = [
+    'Pasientens journaldokumenter', 'Pasientens kritiske informasjon', 'Pasientens prøvesvar',
+    'Pasientens legemiddelliste', 'Pasientens måledata',
+]
+SERVICE_SUBJECTS = [
+    'timeavtaler', 'henvisninger', 'epikriser', 'vaksiner', 'bildesvar', 'allergier',
+    'behandlingsplaner', 'helsekort', 'samtykker', 'pleieplaner', 'røntgensvar', 'kjernedata',
+]
+
+WORDS = (
+    'helse omsorg pasient journal kjernejournal e-resept helsepersonell tjeneste løsning '
+    'informasjon deling dokumentdeling standard kodeverk terminologi forskrift lov krav '
+    'prinsipp veileder utveksling sikkerhet tilgang personvern behandling sykehus kommune '
+    'fastlege legemiddel prøvesvar måledata grensesnitt samhandling nasjonal felles '
+    'tilgjengeliggjøre registrering oppslag innbygger ansvar forvaltning arkitektur '
+    'informasjonsmodell spesifikasjon profil ressurs helsenettet for og i av med til på som '
+    'skal kan være er det den de en et om ved fra blant annet både også særlig økt bruk'
+).split()
+
+def weighted(rng, frequencies):
+    """
+    Return a function drawing values by the given frequencies
+    """
+    values = list(frequencies)
+    cumulative = []
+    total = 0
+    for value in values:
+        total += frequencies[value]
+        cumulative.append(total)
+    return lambda: rng.choices(values, cum_weights=cumulative)[0]
+
+def sentence(rng, min_words, max_words):
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return ' '.join(words).capitalize() + '.'
+
+def service_pool(rows):
+    """
+    The five real services, plus generated ones as the row count grows
+    """
+    extra = min(len(SERVICE_SUBJECTS) * 20, rows // 5000)
+    pool = list(SERVICES)
+    for i in range(extra):
+        subject = SERVICE_SUBJECTS[i % len(SERVICE_SUBJECTS)]
+        suffix = f' {i // len(SERVICE_SUBJECTS) + 1}' if i >= len(SERVICE_SUBJECTS) else ''
+        pool.append(f'Pasientens {subject}{suffix}')
+    return pool
+
+def generate_csv(output_file, rows, seed=0, encoding='cp1252'):
+    """
+    Write a synthetic raw regulation export with the given number of rows
+    """
+    rng = random.Random(seed)
+    informasjonstype = weighted(rng, INFORMASJONSTYPER)
+    eif_niva = weighted(rng, EIF_NIVAER)
+    status = weighted(rng, STATUSER)
+    normeringsniva = weighted(rng, NORMERINGSNIVAER)
+    ansvarlig = weighted(rng, ANSVARLIGE)
+    service_count = weighted(rng, SERVICE_COUNTS)
+
+    # A few services are linked far more often than the rest
+    services = service_pool(rows)
+    service_weights = [1 / rank for rank in range(1, len(services) + 1)]
+
+    with open(output_file, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(RAW_COLUMNS)
+        for i in range(rows):
+            linked = set()
+            wanted = min(MANY_SERVICES if i % MANY_SERVICES_EVERY == 0 else service_count(), len(services))
+            while len(linked) < wanted:
+                linked.add(rng.choices(services, weights=service_weights)[0])
+            navn = sentence(rng, 3, 8).rstrip('.') + f' {i}'
+            has_reference = rng.random() < 0.93
+            writer.writerow([
+                informasjonstype(),
+                navn,
+                sentence(rng, 8, 20) if rng.random() < 0.03 else '',
+                ' '.join(sentence(rng, 8, 25) for _ in range(rng.randint(1, 3))),
+                sentence(rng, 10, 30) if rng.random() < 0.05 else '',
+                normeringsniva(),
+                eif_niva(),
+                status(),
+                ', '.join(sorted(linked)),
+                ansvarlig(),
+                'Veileder' if rng.random() < 0.17 else '',
+                f'{navn} (ehelse.no)' if has_reference else '',
+                f'https://www.ehelse.no/dokumenter/{i}' if has_reference else '',
+            ])
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python -m benchmarks.synthetic output.csv rows [seed]")
+        sys.exit(1)
+
+    generate_csv(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) == 4 else 0)
@@ -0,0 +1,53 @@
+import gzip
+import lzma
+import os
+
+# Leading bytes of each supported compression format
+MAGIC_BYTES = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+EXTENSIONS = {'.gz': 'gzip', '.xz': 'xz', '.zst': 'zstd', '.zstd': 'zstd'}
+
+# Same default as the gzip command line tool; gzip.open defaults to 9,
+# which is several times slower for little gain on CSV text
+GZIP_LEVEL = 6
+
+def compression_of(path, mode='r'):
+    """
+    Return 'gzip', 'xz', 'zstd' or None for a file. Files being read are
+    recognised by their magic bytes, files being written by their extension.
+    """
+    if 'r' in mode and os.path.exists(path):
+        with open(path, 'rb') as f:
+            head = f.read(6)
+        for magic, compression in MAGIC_BYTES:
+            if head.startswith(magic):
+                return compression
+        return None
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+def open_stream(path, mode='r', encoding=None, errors=None, newline=None):
+    """
+    Open a plain, gzip, xz or zstd file like the builtin open, compressing
+    or decompressing on the fly. mode is one of 'r', 'w', 'rb' or 'wb'.
+    zstd needs the zstandard package.
+    """
+    compression = compression_of(path, mode)
+    text = {} if 'b' in mode else {'encoding': encoding, 'errors': errors, 'newline': newline}
+    mode = mode if 'b' in mode else mode + 't'
+
+    if compression is None:
+        return open(path, mode, **text)
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL, **text)
+    if compression == 'xz':
+        return lzma.open(path, mode, **text)
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing zstd files needs zstandard: pip install zstandard")
+    return zstandard.open(path, mode, **text)
@@ -1,48 +1,300 @@
 import csv
 import codecs
+import contextlib
+import glob
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import chardet
+from operator import itemgetter
 
-def convert_csv(input_file, output_file):
+from compressed_io import open_stream
+
+# Bytes read from the start of the input to detect its encoding
+SAMPLE_SIZE = 1024 * 1024
+
+# Bytes fed to the detector at a time, so it can stop as soon as it is sure
+DETECT_BLOCK_SIZE = 64 * 1024
+
+# Used when the detector cannot tell; the raw exports come from Windows
+FALLBACK_ENCODING = 'cp1252'
+
+# Conversion hashes of the last successful batch conversions, kept in the output directory
+STATE_FILE = '.convert_state.json'
+
+def detect_encoding(input_file, sample_size=SAMPLE_SIZE):
+    """
+    Detect the encoding of a file from a bounded sample of its first bytes,
+    so detection takes the same time however large the file is. Returns
+    (encoding, confidence).
+    """
+    with open_stream(input_file, 'rb') as f:
+        sample = f.read(sample_size)
+
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'),
+                          (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if sample.startswith(bom):
+            return encoding, 1.0
+
+    # Fast path: valid UTF-8. The sample may end inside a multibyte character.
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8', 1.0
+    except UnicodeDecodeError:
+        pass
+
+    detector = chardet.UniversalDetector()
+    for start in range(0, len(sample), DETECT_BLOCK_SIZE):
+        detector.feed(sample[start:start + DETECT_BLOCK_SIZE])
+        if detector.done:
+            break
+    result = detector.close()
+
+    encoding = result['encoding']
+    # The sample is not UTF-8, so it is not ASCII either: the detector gave
+    # up, or stopped early on the ASCII start of the sample
+    if not encoding or codecs.lookup(encoding).name == 'ascii':
+        return FALLBACK_ENCODING, 0.0
+    # Latin-1 and cp1252 agree on all letters; cp1252 also decodes the
+    # quotes and dashes Windows puts in 0x80-0x9F
+    if codecs.lookup(encoding).name == 'iso8859-1':
+        encoding = FALLBACK_ENCODING
+    return encoding, result['confidence']
+
+# Columns kept from the raw export, in output order
+COLUMNS = [
+    'informasjonstype', 'navn', 'ingress', 'beskrivelse',
+    'kontekstavhengig_beskrivelse', 'normeringsniva', 'eif_niva',
+    'status', 'samhandlingstjenester', 'ansvarlig',
+    'referanse_lenketekst', 'referanse_url'
+]
+
+def column_projection(header, columns):
+    """
+    Return a function that picks `columns` out of a csv.reader row as a
+    tuple. Columns are resolved to header positions once; a column missing
+    from the header, or from a short row, comes out as ''. As with
+    DictReader, the last of several columns with the same name wins.
+    """
+    positions = {name: i for i, name in enumerate(header)}
+    width = len(header)
+    # Missing columns read the '' appended after the last real column
+    getter = itemgetter(*[positions.get(column, width) for column in columns])
+
+    def project(row):
+        if len(row) != width:
+            row = row[:width] + [''] * (width - len(row))
+        row.append('')
+        return getter(row)
+
+    if len(columns) == 1:
+        return lambda row: (project(row),)
+    return project
+
+def read_rows(input_file, encoding, columns, rename):
+    """
+    Yield the output header and then each projected row of a raw export,
+    decoded strictly with the given encoding
+    """
+    with open_stream(input_file, 'r', encoding=encoding, newline='') as input_csv:
+        reader = csv.reader(input_csv)
+        project = column_projection(next(reader, []), columns)
+        yield [rename.get(column, column) for column in columns]
+
+        # Blank lines are skipped, as DictReader does
+        yield from map(project, filter(None, reader))
+
+def read_export(input_file, columns=COLUMNS, rename=None):
+    """
+    Yield the output header and then each row of a raw export as a tuple,
+    decoded with the detected encoding and projected to `columns`. Used by
+    convert_csv, and by sqlite_builder to load a raw export in one pass.
+
+    The encoding is detected from the start of the file only, so bytes
+    further on may not decode. The export is then read again as
+    FALLBACK_ENCODING from the first row not yet yielded, rather than
+    replacing the characters.
+    """
     # First, detect the encoding of the input file
-    with open(input_file, 'rb') as f:
-        result = chardet.detect(f.read())
-    
-    detected_encoding = result['encoding']
-    print(f"Detected encoding: {detected_encoding} with confidence {result['confidence']}")
-    
-    # These are the columns we want to keep
-    columns_to_keep = [
-        'informasjonstype', 'navn', 'ingress', 'beskrivelse', 
-        'kontekstavhengig_beskrivelse', 'normeringsniva', 'eif_niva', 
-        'status', 'samhandlingstjenester', 'ansvarlig', 
-        'referanse_lenketekst', 'referanse_url'
-    ]
-    
-    # Open the input file with detected encoding
-    with codecs.open(input_file, 'r', encoding=detected_encoding, errors='replace') as input_csv:
-        reader = csv.DictReader(input_csv)
-        
-        # Open the output file with UTF-8 encoding
-        with codecs.open(output_file, 'w', encoding='utf-8') as output_csv:
-            # Create a writer with only the columns we want to keep
-            writer = csv.DictWriter(output_csv, fieldnames=columns_to_keep)
-            writer.writeheader()
-            
-            # Process each row, keeping only the specified columns
-            for row in reader:
-                filtered_row = {column: row.get(column, '') for column in columns_to_keep}
-                writer.writerow(filtered_row)
-    
+    detected_encoding, confidence = detect_encoding(input_file)
+    print(f"Detected encoding: {detected_encoding} with confidence {confidence}")
+
+    rename = rename or {}
+
+    yielded = 0
+    try:
+        for row in read_rows(input_file, detected_encoding, columns, rename):
+            yield row
+            yielded += 1
+    except UnicodeDecodeError as e:
+        if codecs.lookup(detected_encoding).name == codecs.lookup(FALLBACK_ENCODING).name:
+            raise
+        print(f"Not valid {detected_encoding} after {yielded} rows ({e.reason}), "
+              f"reading the rest as {FALLBACK_ENCODING}")
+        yield from itertools.islice(read_rows(input_file, FALLBACK_ENCODING, columns, rename), yielded, None)
+
+def convert_csv(input_file, output_file, columns=COLUMNS, rename=None):
+    """
+    Convert a raw export to a UTF-8 CSV with only the given columns, renamed
+    through the optional rename map {input name: output name}. Either file
+    may be gzip, xz or zstd compressed; see compressed_io.
+    """
+    rows = read_export(input_file, columns, rename)
+    header = next(rows)
+
+    # Open the output file with UTF-8 encoding
+    with open_stream(output_file, 'w', encoding='utf-8', newline='') as output_csv:
+        writer = csv.writer(output_csv)
+        writer.writerow(header)
+        writer.writerows(rows)
+
     print(f"Conversion complete. Output saved to {output_file}")
 
+def parse_rename(pairs):
+    """Turn ['old=new', ...] into {'old': 'new', ...}"""
+    rename = {}
+    for pair in pairs:
+        old, sep, new = pair.partition('=')
+        if not sep:
+            raise ValueError(f"Expected old=new, got: {pair}")
+        rename[old] = new
+    return rename
+
+def file_hash(path, block_size=1024 * 1024):
+    """SHA-1 of a file's contents, read in blocks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def conversion_hash(path, columns, rename):
+    """
+    SHA-1 of a file's contents together with the columns and renames it is
+    converted with, so changing either makes the file convert again
+    """
+    settings = json.dumps([list(columns), sorted((rename or {}).items())], ensure_ascii=False)
+    return hashlib.sha1(f'{file_hash(path)}\x1f{settings}'.encode('utf-8')).hexdigest()
+
+def read_manifest(manifest_file):
+    """
+    Input files listed one per line in a manifest, relative to the manifest.
+    Blank lines and lines starting with # are ignored.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+def convert_job(input_file, output_file, previous_hash, columns, rename):
+    """
+    Convert one file of a batch in a worker process, unless its conversion
+    hash matches previous_hash and the output is still there. Returns
+    (status, conversion hash, seconds, error).
+    """
+    start = time.perf_counter()
+    try:
+        digest = conversion_hash(input_file, columns, rename)
+        if digest == previous_hash and os.path.exists(output_file):
+            return 'skipped', digest, time.perf_counter() - start, None
+        with contextlib.redirect_stdout(io.StringIO()):
+            convert_csv(input_file, output_file, columns, rename)
+        return 'converted', digest, time.perf_counter() - start, None
+    except Exception as e:
+        return 'failed', None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+def convert_batch(input_files, output_dir, workers=None, columns=COLUMNS, rename=None):
+    """
+    Convert many exports concurrently on a process pool, writing each to
+    output_dir under its own file name. The conversion hash of every
+    successful conversion is kept in output_dir/STATE_FILE, and inputs whose
+    contents, columns and renames have not changed since are skipped.
+    Returns the number of failed files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    for input_file in input_files:
+        if os.path.abspath(input_file) in outputs:
+            continue
+        output_file = os.path.join(output_dir, os.path.basename(input_file))
+        if output_file in outputs.values():
+            raise ValueError(f"Two inputs would be written to {output_file}")
+        outputs[os.path.abspath(input_file)] = output_file
+
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_job, input_file, output_file, state.get(input_file),
+                            columns, rename): input_file
+            for input_file, output_file in outputs.items()
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    failed = 0
+    print(f"{'status':10} {'seconds':>8} {'MB':>8}  file")
+    for input_file in sorted(results):
+        status, digest, seconds, error = results[input_file]
+        size_mb = os.path.getsize(input_file) / 1e6 if os.path.exists(input_file) else 0
+        print(f"{status:10} {seconds:8.2f} {size_mb:8.1f}  {input_file}")
+        if error:
+            print(f"{'':28}{error}")
+            failed += 1
+        elif status == 'converted':
+            state[input_file] = digest
+
+    # Only successful conversions are recorded, so failures are retried
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+
+    counts = {status: sum(1 for result in results.values() if result[0] == status)
+              for status in ('converted', 'skipped', 'failed')}
+    print(f"{len(results)} files in {time.perf_counter() - start:.2f}s: "
+          f"{counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed")
+    return failed
+
 if __name__ == "__main__":
+    import argparse
     import sys
-    
-    if len(sys.argv) != 3:
-        print("Usage: python csv_converter.py input.csv output.csv")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    
-    convert_csv(input_file, output_file)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Convert raw regulation exports to UTF-8 CSVs")
+    parser.add_argument('input_file', nargs='?', help="raw CSV export in any encoding")
+    parser.add_argument('output_file', nargs='?', help="UTF-8 CSV to write")
+    parser.add_argument('--columns', nargs='+', default=COLUMNS,
+                        help="columns to keep, in output order (default: the sqlite_builder columns)")
+    parser.add_argument('--rename', nargs='+', default=[], metavar='OLD=NEW',
+                        help="rename columns in the output header")
+    parser.add_argument('--batch', nargs='+', default=[], metavar='PATTERN',
+                        help="convert every file matching these glob patterns into --output-dir")
+    parser.add_argument('--manifest', help="convert the files listed in this file into --output-dir")
+    parser.add_argument('--output-dir', help="directory for batch output")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes in batch mode (default: CPU count)")
+    args = parser.parse_args()
+    rename = parse_rename(args.rename)
+
+    if args.batch or args.manifest:
+        if not args.output_dir:
+            parser.error("--batch and --manifest need --output-dir")
+        input_files = [path for pattern in args.batch for path in sorted(glob.glob(pattern))]
+        if args.manifest:
+            input_files.extend(read_manifest(args.manifest))
+        if not input_files:
+            parser.error("no input files found")
+        sys.exit(1 if convert_batch(input_files, args.output_dir, args.workers, args.columns, rename) else 0)
+
+    if not args.input_file or not args.output_file:
+        parser.error("give input_file and output_file, or --batch/--manifest with --output-dir")
+    convert_csv(args.input_file, args.output_file, args.columns, rename)
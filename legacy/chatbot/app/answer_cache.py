@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers keyed on query embeddings. A query whose
+    embedding is within `threshold` cosine similarity of a cached query gets
+    that query's answer back. Entries expire after ttl seconds, the least
+    recently used are evicted beyond max_entries, and everything is dropped
+    when the index version (the Chroma collection the answers were built
+    from) changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, max_entries: int = 500):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (unit query vector, answer tokens, created at)
+        self._entries = OrderedDict()
+        self._keys = itertools.count()
+        self._index_version = None
+        self._lock = threading.Lock()
+        # Stacked vectors of all entries, rebuilt after the entries change
+        self._matrix = None
+        self._matrix_keys = []
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version: str):
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._matrix = None
+            self._index_version = index_version
+
+    def _expire(self, now: float):
+        expired = [key for key, (_, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, embedding: List[float], index_version: str) -> Optional[List[str]]:
+        """Return the cached answer tokens of the closest similar query, or None"""
+        with self._lock:
+            self._check_version(index_version)
+            self._expire(time.time())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key][0] for key in self._matrix_keys])
+
+            similarities = self._matrix @ self._unit(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][1]
+
+    def store(self, embedding: List[float], answer: List[str], index_version: str):
+        """Cache the answer tokens generated for a query"""
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[next(self._keys)] = (self._unit(embedding), list(answer), time.time())
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+            }
@@ -8,7 +8,13 @@ import asyncio
 from icecream import ic
 from dotenv import load_dotenv
 import json
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from .utils import read_json_file
+from .embedding_cache import EmbeddingCache
+from .answer_cache import SemanticAnswerCache
+from .lexical_index import BM25Index, reciprocal_rank_fusion
 
 CONFIG = read_json_file('app/config.json')
 SECRETS = read_json_file('secrets.json')
@@ -20,32 +26,214 @@ client = AsyncOpenAI(api_key=SECRETS['openai_api_key'])
 chroma_client = chromadb.PersistentClient(path=CONFIG['chroma_db_path'])
 collection = chroma_client.get_collection(CONFIG['collection_name'])
 
+# Chroma calls are synchronous and CPU-bound (HNSW search plus loading the
+# documents), so they run on their own bounded pool instead of blocking the
+# event loop and every other SSE stream
+retrieval_pool = ThreadPoolExecutor(
+    max_workers = CONFIG['retrieval_workers'],
+    thread_name_prefix = 'retrieval')
+retrieval_slots = asyncio.Semaphore(CONFIG['retrieval_max_concurrency'])
+
+def load_lexical_index():
+    """
+    Load the BM25 index vector_db_creator built next to the collection, or
+    return None so retrieval falls back to vector search alone. An index
+    built for another collection is not used either.
+    """
+    path = CONFIG['lexical_index_path']
+    if not os.path.exists(path):
+        print(f"Warning: no lexical index at {path}, run vector_db_creator.py to build it")
+        return None
+    index = BM25Index.load(path)
+    if index.collection_id != str(collection.id):
+        print(f"Warning: lexical index {path} was built for another collection")
+        return None
+    return index
+
+def lexical_signature():
+    """
+    The collection id and lexical index file modification time a load of
+    the lexical index would see
+    """
+    try:
+        mtime = os.stat(CONFIG['lexical_index_path']).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    return str(collection.id), mtime
+
+# Context is measured in tokens of the completion model. Chunks were cut in
+# tokens of the embedding model (see vector_db_creator), so their overlap is
+# trimmed in those.
+try:
+    tokenizer = tiktoken.encoding_for_model(CONFIG['completion_model_name'])
+except KeyError:
+    tokenizer = tiktoken.get_encoding('o200k_base')
+chunk_tokenizer = tiktoken.encoding_for_model(CONFIG['embedding_model_name'])
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# BM25 over the same chunks, fused with the vector results. When there is
+# none, or only one for another collection, loading is retried once the
+# collection or the index file changes.
+lexical_attempt = lexical_signature()
+lexical_index = load_lexical_index()
+
+# Query embeddings, so repeat questions skip the embeddings API
+embedding_cache = EmbeddingCache(
+    CONFIG['embedding_cache_path'],
+    memory_size = CONFIG['embedding_cache_memory_size'],
+    max_entries = CONFIG['embedding_cache_max_entries'])
+
+# Answers to earlier questions, replayed for near-duplicate questions
+answer_cache = SemanticAnswerCache(
+    threshold = CONFIG['answer_cache_threshold'],
+    ttl = CONFIG['answer_cache_ttl_seconds'],
+    max_entries = CONFIG['answer_cache_max_entries'])
+
+# generate_response yields this, followed by the exception, when it fails
+ERROR_PREFIX = "Error in generate_response"
+
 THREAD_ID = None
 ASSISTANT_ID = None
 
-async def get_relevant_context(query: str) -> str: #Check why this function is different from same function in assistant script
+async def run_retrieval(func, *args, **kwargs):
+    """
+    Run a blocking Chroma call on the retrieval pool. At most
+    retrieval_max_concurrency calls wait at a time, and a call taking longer
+    than retrieval_timeout_seconds raises asyncio.TimeoutError. A call that
+    times out keeps its slot until its thread finishes, so timed out calls
+    cannot pile up on the pool.
+    """
+    await retrieval_slots.acquire()
+    loop = asyncio.get_running_loop()
+    try:
+        future = loop.run_in_executor(retrieval_pool, functools.partial(func, *args, **kwargs))
+    except BaseException:
+        retrieval_slots.release()
+        raise
+    # Also retrieves the exception of an abandoned call, so it is not logged
+    future.add_done_callback(lambda done: (retrieval_slots.release(), done.cancelled() or done.exception()))
+    return await asyncio.wait_for(asyncio.shield(future), timeout = CONFIG['retrieval_timeout_seconds'])
+
+async def get_index_version() -> str:
+    """
+    Identify the current build of the Chroma collection. vector_db_creator
+    deletes and recreates the collection, which gives it a new id, so the
+    collection handle is refreshed when the id changes. The lexical index is
+    reloaded with it, and retried while missing or mismatched.
+    """
+    global collection, lexical_index, lexical_attempt
+    current = await run_retrieval(chroma_client.get_collection, CONFIG['collection_name'])
+    if current.id != collection.id:
+        collection = current
+        lexical_index = None
+    if lexical_index is None:
+        signature = lexical_signature()
+        if signature != lexical_attempt:
+            lexical_attempt = signature
+            lexical_index = await run_retrieval(load_lexical_index)
+    return str(collection.id)
+
+async def get_query_embedding(query: str) -> list:
+    """
+    Embed a query, from the embedding cache when it has been seen before
+    """
+    model = CONFIG['embedding_model_name']
+    embedding = await embedding_cache.get(model, query)
+    if embedding is None:
+        response = await client.embeddings.create(
+            model = model,
+            input = query)
+        embedding = await embedding_cache.put(model, query, response.data[0].embedding)
+    return embedding
+
+def chunk_position(metadata: dict):
+    """(source, chunk number) of a chunk from vector_db_creator, or None"""
+    if not metadata or 'chunk_idx' not in metadata:
+        return None
+    source = metadata.get('source_idx', metadata.get('source'))
+    if source is None:
+        return None
+    return source, int(metadata['chunk_idx'])
+
+def pack_context(chunks: list, budget: int):
     """
-    Retrieve relevant context from the vector database
+    Pack (score, text, metadata) chunks into at most `budget` tokens, best
+    score first. Duplicate chunks are dropped, and the overlap a chunk
+    shares with an already packed neighbour from the same source is cut.
+    A chunk that does not fit is skipped so smaller ones can still fill the
+    budget. Returns (context, tokens used, chunks packed).
     """
-    # Get embeddings for the query
-    response = await client.embeddings.create(
-        model = CONFIG['embedding_model_name'],
-        input = query)
-    
-    query_embedding = response.data[0].embedding
+    overlap = CONFIG['chunk_overlap']
+    separator_tokens = len(tokenizer.encode(CONTEXT_SEPARATOR))
+    packed = []
+    positions = set()
+    texts = set()
+    used = 0
+
+    for score, original, metadata in sorted(chunks, key = lambda chunk: chunk[0], reverse = True):
+        position = chunk_position(metadata)
+        if position in positions or original in texts:
+            continue
+
+        text = original
+        if position is not None and overlap:
+            source, number = position
+            after_previous = (source, number - 1) in positions
+            before_next = (source, number + 1) in positions
+            if after_previous or before_next:
+                tokens = chunk_tokenizer.encode(text)
+                start = overlap if after_previous else 0
+                end = len(tokens) - overlap if before_next else len(tokens)
+                text = chunk_tokenizer.decode(tokens[start:end]) if end > start else ''
+
+        cost = len(tokenizer.encode(text)) + (separator_tokens if packed else 0)
+        if not text.strip() or used + cost > budget:
+            continue
+
+        packed.append(text)
+        used += cost
+        texts.add(original)
+        if position is not None:
+            positions.add(position)
 
-    # Query ChromaDB
-    results = collection.query(
+    return CONTEXT_SEPARATOR.join(packed), used, len(packed)
+
+async def get_relevant_context(query: str, query_embedding: list) -> str: #Check why this function is different from same function in assistant script
+    """
+    Retrieve relevant context from the vector database for a query and its
+    embedding
+    """
+    # Dense and lexical candidates, fused by reciprocal rank
+    candidates = CONFIG['retrieval_candidates']
+    vector_search = run_retrieval(
+        collection.query,
         query_embeddings = [query_embedding],
-        n_results = CONFIG['top_k'])
+        n_results = candidates)
+    if lexical_index is None:
+        results = await vector_search
+        lexical_ids = []
+    else:
+        results, lexical = await asyncio.gather(
+            vector_search,
+            run_retrieval(lexical_index.search, query, candidates))
+        lexical_ids = [id_ for id_, _ in lexical]
+
+    vector_ids = results['ids'][0]
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids], k = CONFIG['rrf_k'])[:CONFIG['top_k']]
+
+    # Chunks only the lexical index found are fetched by id
+    found = dict(zip(vector_ids, zip(results['documents'][0], results['metadatas'][0])))
+    missing = [id_ for id_, _ in fused if id_ not in found]
+    if missing:
+        extra = await run_retrieval(collection.get, ids = missing, include = ['documents', 'metadatas'])
+        found.update(zip(extra['ids'], zip(extra['documents'], extra['metadatas'])))
 
-    # Combine relevant chunks
-    contexts = results['documents'][0]
-    print(len(contexts))
-    for item in contexts:
-        print("New item")
-        print(f"{item} \n")
-    return "\n\n---\n\n".join(contexts)
+    # Combine relevant chunks within the token budget
+    chunks = [(score, *found[id_]) for id_, score in fused if id_ in found]
+    context, tokens, packed = pack_context(chunks, CONFIG['context_token_budget'])
+    print(f"Debug: Packed {packed} of {len(chunks)} chunks into {tokens} context tokens")
+    return context
 
 async def create_assistant():
   global ASSISTANT_ID
@@ -162,6 +350,7 @@ async def generate_response(query: str, context: str) -> AsyncGenerator[str, Non
         
         # Always combine context with query for better responses
         enriched_query = f"Context:\n{context}\n\nQuestion: {query}"
+        print(f"Debug: Prompt tokens: {len(tokenizer.encode(enriched_query))}")
         
         # Create the message in the thread
         await client.beta.threads.messages.create(
@@ -232,15 +421,44 @@ async def generate_response(query: str, context: str) -> AsyncGenerator[str, Non
                                     yield content_block.text.value
 
     except Exception as e:
-        error_message = f"Error in generate_response: {str(e)}"
+        error_message = f"{ERROR_PREFIX}: {str(e)}"
         print(f"Debug: {error_message}")
         yield error_message
 
-async def get_streaming_response(query: str) -> AsyncGenerator[str, None]:
+async def get_streaming_response(query: str, use_cache: bool = True) -> AsyncGenerator[str, None]:
   """
-  Main function to handle the chat workflow
+  Main function to handle the chat workflow. With use_cache False the
+  answer cache is not consulted, so the answer is always retrieved and
+  generated.
   """
-  #context = await get_relevant_context(query)
-  context = ""
+  try:
+      query_embedding = await get_query_embedding(query)
+      index_version = await get_index_version()
+
+      # Replay the answer to a near-duplicate question through the same stream
+      cached_answer = answer_cache.lookup(query_embedding, index_version) if use_cache else None
+      if cached_answer is None:
+          context = await get_relevant_context(query, query_embedding)
+  except asyncio.TimeoutError:
+      yield "Error in get_streaming_response: the knowledge base did not respond in time"
+      return
+  except Exception as e:
+      # For example the collection being missing while vector_db_creator rebuilds it
+      error_message = f"Error in get_streaming_response: {str(e)}"
+      print(f"Debug: {error_message}")
+      yield error_message
+      return
+
+  if cached_answer is not None:
+      for token in cached_answer:
+          yield token
+      return
+
+  answer = []
   async for token in generate_response(query, context):
+      answer.append(token)
       yield token
+
+  # Only complete answers are cached; a disconnect never gets here
+  if answer and not any(token.startswith(ERROR_PREFIX) for token in answer):
+      answer_cache.store(query_embedding, answer, index_version)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Memory hits are written back to last_used on disk this many keys at a time
+TOUCH_BATCH_SIZE = 64
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed on model name and normalized
+    query text. The first tier is an in-process LRU. The second is a SQLite
+    file holding float32 blobs, which survives restarts and is trimmed to
+    max_entries by least recent use.
+
+    The SQLite tier runs on a single thread of its own, so lookups never
+    block the event loop. Memory hits are recorded and written to last_used
+    in batches, and always before an eviction.
+    """
+
+    def __init__(self, path: str, memory_size: int = 1024, max_entries: int = 100000):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        # key -> time of memory hits not yet written to disk
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-cache')
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+          key TEXT PRIMARY KEY,
+          model TEXT NOT NULL,
+          embedding BLOB NOT NULL,
+          last_used REAL NOT NULL
+        )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)')
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def key(model: str, query: str) -> str:
+        return hashlib.sha1(f'{model}\x1f{normalize_query(query)}'.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, embedding: List[float]):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[List[float]]:
+        row = self._conn.execute('SELECT embedding FROM embeddings WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute('UPDATE embeddings SET last_used = ? WHERE key = ?', (time.time(), key))
+        return array('f', row[0]).tolist()
+
+    def _write_touched(self, touched: Dict[str, float]):
+        self._conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?',
+                               [(last_used, key) for key, last_used in touched.items()])
+
+    def _write(self, key: str, model: str, blob: bytes):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        self._write_touched(touched)
+        updated = self._conn.execute(
+            'UPDATE embeddings SET embedding = ?, last_used = ? WHERE key = ?',
+            (blob, time.time(), key)).rowcount
+        if not updated:
+            self._conn.execute(
+                'INSERT INTO embeddings (key, model, embedding, last_used) VALUES (?, ?, ?, ?)',
+                (key, model, blob, time.time()))
+            self._entries += 1
+        if self._entries > self.max_entries:
+            # Trim a tenth at a time so eviction is not paid on every put
+            excess = self._entries - self.max_entries + self.max_entries // 10
+            self._conn.execute('''
+            DELETE FROM embeddings WHERE key IN (
+              SELECT key FROM embeddings ORDER BY last_used LIMIT ?)
+            ''', (excess,))
+            self._entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    async def get(self, model: str, query: str) -> Optional[List[float]]:
+        """Return the cached embedding of a query, or None"""
+        key = self.key(model, query)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self._touched[key] = time.time()
+                touched = None
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    touched, self._touched = self._touched, {}
+                embedding = self._memory[key]
+            else:
+                embedding = None
+        if embedding is not None:
+            if touched:
+                self._executor.submit(self._write_touched, touched)
+            return embedding
+
+        loop = asyncio.get_running_loop()
+        embedding = await loop.run_in_executor(self._executor, self._read, key)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+            else:
+                self._remember(key, embedding)
+                self.disk_hits += 1
+        return embedding
+
+    async def put(self, model: str, query: str, embedding: List[float]) -> List[float]:
+        """
+        Store an embedding in both tiers as float32 and return the stored
+        values, so a hit gives back exactly what the miss used
+        """
+        key = self.key(model, query)
+        packed = array('f', embedding)
+        embedding = packed.tolist()
+        with self._lock:
+            self._remember(key, embedding)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._write, key, model, packed.tobytes())
+        return embedding
+
+    def stats(self) -> Dict[str, float]:
+        """Hit counters for both tiers and the overall hit rate"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._entries,
+            }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Words, keeping codes like ICPC-2, HL7 or 2.16.578.1 together
+TOKEN_PATTERN = re.compile(r'\w+(?:[-./]\w+)*')
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens of a text. A hyphenated or dotted code is kept as
+    one token and also split into its parts, so "ICPC-2" matches both
+    "ICPC-2" and "ICPC 2".
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).casefold()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.split(r'[-./]', token))
+    return tokens
+
+class BM25Index:
+    """
+    Okapi BM25 index over the same chunks as the Chroma collection, for
+    exact-term matches that dense retrieval misses. Built by
+    vector_db_creator and saved as JSON next to the collection; the chatbot
+    loads it once at startup.
+    """
+
+    def __init__(self, ids: List[str], lengths: List[int], postings: Dict[str, List[Tuple[int, int]]],
+                 collection_id: str = None, k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.lengths = lengths
+        # term -> [(document number, term frequency), ...]
+        self.postings = postings
+        # Id of the Chroma collection built from the same chunks
+        self.collection_id = collection_id
+        self.k1 = k1
+        self.b = b
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        count = len(ids)
+        self.idf = {term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for term, docs in postings.items()}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], documents: Iterable[str], collection_id: str = None) -> 'BM25Index':
+        postings = defaultdict(list)
+        lengths = []
+        for number, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings[term].append((number, frequency))
+        return cls(list(ids), lengths, dict(postings), collection_id)
+
+    def save(self, path: str):
+        """Write the index to a JSON file, replacing any previous one atomically"""
+        data = {'ids': self.ids, 'lengths': self.lengths, 'postings': self.postings,
+                'collection_id': self.collection_id}
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        postings = {term: [tuple(entry) for entry in docs] for term, docs in data['postings'].items()}
+        return cls(data['ids'], data['lengths'], postings, data.get('collection_id'))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """The k best matching chunk ids for a query, with their BM25 scores"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for number, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[number] / self.average_length)
+                scores[number] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[number], score) for number, score in best]
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of ids into one, scoring each id by the sum of
+    1 / (k + rank) over the rankings it appears in. Returns (id, score)
+    pairs, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
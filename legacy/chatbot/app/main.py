@@ -4,10 +4,13 @@ from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import StreamingResponse
-from app import chat
+from app import chat, regulations_api
 
 app = FastAPI()
 
+# Read-only JSON API over regulations.sqlite
+app.include_router(regulations_api.router)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -19,14 +22,21 @@ async def root(request: Request):
     """Endpoint to get landing page"""
     return templates.TemplateResponse("chat.html", {"request": request})
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Endpoint to get hit counters of the embedding and answer caches"""
+    return {"embeddings": chat.embedding_cache.stats(), "answers": chat.answer_cache.stats()}
+
 @app.post("/chat")
 async def chat_endpoint(request: Request):
     """Endpoint to handle chat submissions"""
     data = await request.json()
     query = data.get("query")
+    # Cache-Control: no-cache asks for a freshly generated answer, as load_test.py does
+    use_cache = 'no-cache' not in request.headers.get('cache-control', '')
     
     async def event_generator():
-        async for token in chat.get_streaming_response(query):
+        async for token in chat.get_streaming_response(query, use_cache):
             yield f"data: {token}\n\n"
     
     return StreamingResponse(
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+from .utils import read_json_file
+
+# regulation_queries lives at the root of the repository, next to regulations.sqlite
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from regulation_queries import CHANGES_SINCE_SQL, LATEST_BUILD_SQL
+
+CONFIG = read_json_file('app/config.json')
+
+DB_PATH = CONFIG['regulations_db_path']
+PAGE_SIZE = CONFIG['api_page_size']
+MAX_PAGE_SIZE = CONFIG['api_max_page_size']
+CACHE_SIZE = CONFIG['api_cache_size']
+
+ENTITY_COLUMNS = [
+    'id', 'informasjonstype', 'navn', 'ingress', 'beskrivelse', 'kontekstavhengig_beskrivelse',
+    'normeringsniva', 'eif_niva', 'status', 'ansvarlig', 'referanse_lenketekst', 'referanse_url'
+]
+
+ENTITY_TABLES = ['reguleringer', 'komponenter']
+
+router = APIRouter(prefix="/api")
+
+class RegulationsDatabase:
+    """
+    Read-only access to regulations.sqlite shared by all request threads.
+    Each thread keeps its own connection. Rendered responses are cached in
+    memory and dropped when the version of the database changes.
+    """
+
+    def __init__(self, db_file, cache_size=CACHE_SIZE):
+        self.db_file = db_file
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        # (file signature, version) of the database the cache belongs to
+        self._build = (None, None)
+
+    def _signature(self):
+        stat = os.stat(self.db_file)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def connection(self):
+        """Return this thread's connection, reopening it if the file changed"""
+        signature = self._signature()
+        local = self._local
+        if getattr(local, 'signature', None) != signature:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            local.conn = sqlite3.connect(f'file:{self.db_file}?mode=ro', uri=True)
+            local.conn.row_factory = sqlite3.Row
+            local.signature = signature
+        return local.conn
+
+    def version(self):
+        """
+        Build hash and latest build id of the database. A build that changes
+        nothing keeps the hash but still adds a build, which /changes reports.
+        Read from the metadata and builds tables written by sqlite_builder, and
+        only re-read when the file changes.
+        """
+        signature = self._signature()
+        with self._lock:
+            if self._build[0] == signature:
+                return self._build[1]
+
+        conn = self.connection()
+        try:
+            row = conn.execute("SELECT value FROM metadata WHERE key = 'build_hash'").fetchone()
+            build_hash = row[0] if row else None
+        except sqlite3.OperationalError:
+            build_hash = None
+        if build_hash is None:
+            # Databases built before metadata existed: fall back to the file itself
+            build_hash = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+        try:
+            build_id = conn.execute(LATEST_BUILD_SQL).fetchone()[0]
+        except sqlite3.OperationalError:
+            build_id = None
+        version = f'{build_hash}:{build_id}'
+
+        with self._lock:
+            if self._build[1] != version:
+                self._cache.clear()
+            self._build = (signature, version)
+        return version
+
+    def cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def store(self, key, body, version):
+        with self._lock:
+            # Skip responses rendered from a database that has since been replaced
+            if self._build[1] == version:
+                self._cache[key] = body
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+db = RegulationsDatabase(DB_PATH)
+
+def cached_response(request: Request, render) -> Response:
+    """
+    Serve a JSON response with a strong ETag derived from the database
+    version and the request URL. Returns 304 when the client already has it,
+    and a cached body when another client asked for the same page.
+    """
+    version = db.version()
+    key = (version, request.url.path, str(request.query_params))
+    etag = '"' + hashlib.sha1('\x1f'.join(key).encode('utf-8')).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    body = db.cached(key)
+    if body is None:
+        body = json.dumps(render(db.connection()), ensure_ascii=False).encode('utf-8')
+        db.store(key, body, version)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+def page(rows, limit, cursor):
+    """Build a page from limit + 1 rows, with the cursor of the last row returned"""
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {'items': items, 'next': next_cursor}
+
+def entity_endpoint(table):
+    def endpoint(request: Request,
+                 after: int = Query(0, description="Return entities with id greater than this"),
+                 limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        def render(conn):
+            rows = conn.execute(
+                f"SELECT {', '.join(ENTITY_COLUMNS)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (after, limit + 1)).fetchall()
+            return page(rows, limit, lambda row: row['id'])
+        return cached_response(request, render)
+    endpoint.__doc__ = f"Page through {table}, ordered by id"
+    return endpoint
+
+for table in ENTITY_TABLES:
+    router.add_api_route(f"/{table}", entity_endpoint(table), methods=["GET"])
+
+@router.get("/samhandlingstjenester")
+def samhandlingstjenester(request: Request,
+                          after: int = Query(0, description="Return services with id greater than this"),
+                          limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """Page through samhandlingstjenester, ordered by id"""
+    def render(conn):
+        rows = conn.execute(
+            'SELECT id, name FROM samhandlingstjeneter WHERE id > ? ORDER BY id LIMIT ?',
+            (after, limit + 1)).fetchall()
+        return page(rows, limit, lambda row: row['id'])
+    return cached_response(request, render)
+
+def parse_kobling_cursor(after):
+    """Split a 'samhandlingstjeneste_id:entity_type:entity_id' cursor"""
+    try:
+        service_id, entity_type, entity_id = after.split(':')
+        return int(service_id), entity_type, int(entity_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {after}")
+
+@router.get("/koblinger")
+def koblinger(request: Request,
+              samhandlingstjeneste_id: Optional[int] = None,
+              after: Optional[str] = Query(None, description="Cursor from the previous page"),
+              limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Page through links between entities and samhandlingstjenester, ordered by
+    (samhandlingstjeneste_id, entity_type, entity_id)
+    """
+    position = parse_kobling_cursor(after) if after else (0, '', 0)
+
+    def render(conn):
+        # Row-value comparison so the seek uses idx_koblinger_tjeneste
+        conditions = ['(samhandlingstjeneste_id, entity_type, entity_id) > (?, ?, ?)']
+        params = list(position)
+        if samhandlingstjeneste_id is not None:
+            conditions.append('samhandlingstjeneste_id = ?')
+            params.append(samhandlingstjeneste_id)
+        rows = conn.execute(f'''
+        SELECT samhandlingstjeneste_id, entity_type, entity_id
+        FROM koblinger
+        WHERE {' AND '.join(conditions)}
+        ORDER BY samhandlingstjeneste_id, entity_type, entity_id
+        LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+        return page(rows, limit, lambda row: '{}:{}:{}'.format(*row))
+    return cached_response(request, render)
+
+# One page of CHANGES_SINCE_SQL, after an (entity_type, entity_id) cursor
+CHANGES_PAGE_SQL = f'''
+SELECT * FROM ({CHANGES_SINCE_SQL})
+WHERE (entity_type, entity_id) > (?, ?)
+ORDER BY entity_type, entity_id
+LIMIT ?
+'''
+
+@router.get("/changes")
+def changes(request: Request,
+            since: int = Query(0, ge=0, description="Last build id the client has processed"),
+            after: Optional[str] = Query(None, description="Cursor from the previous page"),
+            limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Entities inserted, updated or deleted by builds after `since`, with the
+    latest change of each entity, ordered by (entity_type, entity_id).
+    `build` is the current build id to pass as `since` next time. A database
+    built before sqlite_builder kept a changelog gives an empty page with
+    `build` null.
+    """
+    if after:
+        try:
+            entity_type, entity_id = after.split(':')
+            position = (entity_type, int(entity_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {after}")
+    else:
+        position = ('', 0)
+
+    def render(conn):
+        tables = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('builds', 'changelog')"
+        ).fetchone()[0]
+        if tables < 2:
+            return {'items': [], 'next': None, 'build': None}
+        build = conn.execute(LATEST_BUILD_SQL).fetchone()[0]
+        rows = conn.execute(CHANGES_PAGE_SQL, (since,) + position + (limit + 1,)).fetchall()
+        result = page(rows, limit, lambda row: '{}:{}'.format(row['entity_type'], row['entity_id']))
+        result['build'] = build
+        return result
+    return cached_response(request, render)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Load test for the /chat endpoint
+
+Sends batches of concurrent chat requests at increasing concurrency and
+reports time to first token (the first SSE data line that is not an error)
+per level. Requests send Cache-Control: no-cache, so every one goes through
+retrieval instead of being replayed from the answer cache. With retrieval
+blocking the event loop, p99 grows about linearly with the number of
+concurrent requests; with retrieval on its own pool it should grow much
+less. The test exits with status 1 when a request fails, or when p99 at the
+highest level grew by more than --max-growth times the growth in
+concurrency over the lowest level.
+
+--stub-retrieval runs app.chat in this process instead of calling a
+server, with a Chroma collection whose query blocks for the given number of
+milliseconds and with embeddings and generation stubbed, so the contention
+can be measured without an API key or a built collection. Run it from this
+directory, as the app is.
+
+Usage: python load_test.py [--url URL | --stub-retrieval MS] [--concurrency N ...] [--rounds N]
+                           [--max-growth FRACTION]
+"""
+import asyncio
+import contextlib
+import itertools
+import random
+import statistics
+import time
+
+import httpx
+
+QUERIES = [
+    "Hvilke standarder gjelder for e-resept?",
+    "Hva er kravene til sikker identifisering av helsepersonell?",
+    "Hvilke reguleringer gjelder for deling av pasientjournal?",
+    "Hva er forskjellen på obligatorisk og anbefalt normeringsnivå?",
+    "Hvilke samhandlingstjenester bruker HL7 FHIR?",
+    "Hvem er ansvarlig for kjernejournal?",
+    "Hva sier normen om informasjonssikkerhet om logging?",
+    "Hvilke krav gjelder for elektronisk meldingsutveksling?",
+]
+
+# app.chat streams its errors, such as a retrieval timeout, as tokens
+# starting with this
+ERROR_PREFIX = "Error in "
+
+# Share of the growth in concurrency that p99 may grow by, from the lowest
+# to the highest level
+MAX_GROWTH = 0.5
+
+# Latency of each stubbed embeddings call and generated token
+STUB_API_SECONDS = 0.01
+
+async def time_to_first_token(tokens):
+    """Seconds until the first token that is not an error, or None when there is none"""
+    start = time.perf_counter()
+    async with contextlib.aclosing(tokens):
+        async for token in tokens:
+            if token.startswith(ERROR_PREFIX):
+                return None
+            return time.perf_counter() - start
+    return None
+
+async def sse_tokens(client, url, query):
+    """The data payloads of one chat response"""
+    async with client.stream('POST', url, json={'query': query},
+                             headers={'Cache-Control': 'no-cache'}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith('data: '):
+                yield line[len('data: '):]
+
+def http_requests(client, url):
+    async def request(query):
+        try:
+            return await time_to_first_token(sse_tokens(client, url, query))
+        except httpx.HTTPError:
+            return None
+    return request
+
+class StubCollection:
+    """A Chroma collection whose query blocks for delay seconds, as a search does"""
+
+    id = 'load-test-stub'
+
+    def __init__(self, delay, size=30):
+        self.delay = delay
+        self.ids = [f'stub_{i}' for i in range(size)]
+        self.documents = [f"Dokument {i} om {QUERIES[i % len(QUERIES)]}" for i in range(size)]
+        self.metadatas = [{'source': 'stub', 'chunk_idx': i} for i in range(size)]
+
+    def query(self, query_embeddings, n_results, include=None):
+        time.sleep(self.delay)
+        return {
+            'ids': [self.ids[:n_results]],
+            'documents': [self.documents[:n_results]],
+            'metadatas': [self.metadatas[:n_results]],
+            'distances': [[0.0] * min(n_results, len(self.ids))],
+        }
+
+    def get(self, ids=None, include=None):
+        found = [i for i, id_ in enumerate(self.ids) if ids is None or id_ in ids]
+        return {
+            'ids': [self.ids[i] for i in found],
+            'documents': [self.documents[i] for i in found],
+            'metadatas': [self.metadatas[i] for i in found],
+        }
+
+class StubClient:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_collection(self, name):
+        return self.collection
+
+async def stub_embedding(query):
+    await asyncio.sleep(STUB_API_SECONDS)
+    rng = random.Random(query)
+    return [rng.random() for _ in range(16)]
+
+async def stub_generation(query, context):
+    for word in ("Et", "stubbet", "svar."):
+        await asyncio.sleep(STUB_API_SECONDS)
+        yield word
+
+def stub_requests(delay):
+    """
+    Import app.chat with a StubCollection blocking for delay seconds in
+    place of Chroma, and with the OpenAI calls stubbed
+    """
+    import chromadb
+    from app import utils
+
+    collection = StubCollection(delay)
+    chromadb.PersistentClient = lambda path: StubClient(collection)
+    read_json_file = utils.read_json_file
+    utils.read_json_file = lambda path: {'openai_api_key': 'stub'} if path == 'secrets.json' else read_json_file(path)
+
+    from app import chat
+    chat.get_query_embedding = stub_embedding
+    chat.generate_response = stub_generation
+    # Keeps the debug line of every request out of the report
+    chat.print = lambda *args, **kwargs: None
+
+    def request(query):
+        return time_to_first_token(chat.get_streaming_response(query, use_cache=False))
+    return request
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def run(request, levels, rounds):
+    """
+    Send rounds batches of each level of concurrent requests. Returns
+    {level: (failed requests, p99 seconds or None)}.
+    """
+    queries = itertools.cycle(QUERIES)
+    results = {}
+    print(f"{'concurrency':>11} {'requests':>8} {'failed':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for level in levels:
+        timings = []
+        for _ in range(rounds):
+            timings += await asyncio.gather(*[request(next(queries)) for _ in range(level)])
+        ok = [t for t in timings if t is not None]
+        failed = len(timings) - len(ok)
+        if not ok:
+            print(f"{level:11} {len(timings):8} {failed:6} {'n/a':>8} {'n/a':>8} {'n/a':>8}")
+            results[level] = (failed, None)
+            continue
+        results[level] = (failed, percentile(ok, 0.99))
+        print(f"{level:11} {len(timings):8} {failed:6} {statistics.median(ok) * 1000:8.0f} "
+              f"{results[level][1] * 1000:8.0f} {max(ok) * 1000:8.0f}")
+    return results
+
+def problems(results, max_growth=MAX_GROWTH):
+    """Descriptions of the failed requests and of p99 growing with concurrency"""
+    found = [f"{failed} requests failed at concurrency {level}"
+             for level, (failed, _) in results.items() if failed]
+    low, high = min(results), max(results)
+    if high > low and results[low][1] and results[high][1]:
+        growth = results[high][1] / results[low][1] - 1
+        allowed = max_growth * (high / low - 1)
+        if growth > allowed:
+            found.append(f"p99 grew {growth:.0%} from concurrency {low} to {high}, more than {allowed:.0%}")
+    return found
+
+async def main(args):
+    if args.stub_retrieval is not None:
+        return await run(stub_requests(args.stub_retrieval / 1000), args.concurrency, args.rounds)
+    timeout = httpx.Timeout(120.0)
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        return await run(http_requests(client, args.url), args.concurrency, args.rounds)
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Measure time to first token of /chat under concurrency")
+    parser.add_argument('--url', default='http://127.0.0.1:8000/chat', help="chat endpoint")
+    parser.add_argument('--stub-retrieval', type=float, metavar='MS',
+                        help="run app.chat in process with a Chroma query blocking for MS milliseconds")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help="concurrent requests per level")
+    parser.add_argument('--rounds', type=int, default=3, help="batches sent at each level")
+    parser.add_argument('--max-growth', type=float, default=MAX_GROWTH,
+                        help=f"share of the growth in concurrency p99 may grow by (default {MAX_GROWTH})")
+    args = parser.parse_args()
+
+    found = problems(asyncio.run(main(args)), args.max_growth)
+    for problem in found:
+        print(f"FAIL {problem}")
+    if found:
+        sys.exit(1)
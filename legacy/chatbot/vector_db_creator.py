@@ -13,6 +13,7 @@ import logging
 import os
 from pathlib import Path
 from app.utils import read_json_file
+from app.lexical_index import BM25Index
 
 
 CONFIG = read_json_file('app/config.json')
@@ -221,6 +222,17 @@ class EmbeddingPipeline:
         
         logger.info(f"Saved {len(data)} documents to ChromaDB collection '{collection_name}'")
 
+        self.save_lexical_index(ids, documents, str(collection.id), CONFIG['lexical_index_path'])
+
+    def save_lexical_index(self, ids: List[str], documents: List[str], collection_id: str, path: str):
+        """
+        Build the BM25 index the chatbot fuses with vector search, over the
+        same chunks and ids as the ChromaDB collection.
+        """
+        index = BM25Index.build(ids, documents, collection_id)
+        index.save(path)
+        logger.info(f"Saved BM25 index of {len(ids)} chunks and {len(index.postings)} terms to {path}")
+
 if __name__ == "__main__":
     # Initialize the pipeline
     pipeline = EmbeddingPipeline()
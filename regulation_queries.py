@@ -0,0 +1,398 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from sqlite_builder import ENTITY_COLUMNS, ENTITY_TABLES
+
+# Size of sqlite3's per-connection prepared statement cache
+CACHED_STATEMENTS = 64
+
+# Number of query results kept in the LRU cache
+CACHE_SIZE = 1024
+
+class Entity(NamedTuple):
+    entity_type: str
+    id: int
+    informasjonstype: Optional[str]
+    navn: str
+    ingress: Optional[str]
+    beskrivelse: Optional[str]
+    kontekstavhengig_beskrivelse: Optional[str]
+    normeringsniva: Optional[str]
+    eif_niva: Optional[str]
+    status: Optional[str]
+    ansvarlig: Optional[str]
+    referanse_lenketekst: Optional[str]
+    referanse_url: Optional[str]
+
+class Related(NamedTuple):
+    entity_type: str
+    id: int
+    navn: str
+    shared_services: int
+    jaccard: float
+
+class Change(NamedTuple):
+    build_id: int
+    entity_type: str
+    entity_id: int
+    operation: str
+    content_hash: Optional[str]
+
+def _entity_select(entity_type, alias, leading=''):
+    columns = ', '.join(f'{alias}.{column}' for column in ENTITY_COLUMNS)
+    return f"SELECT {leading}'{entity_type}', {alias}.id, {columns} FROM {ENTITY_TABLES[entity_type]} {alias}"
+
+# The SQL text is fixed so every call reuses the connection's prepared statement
+ENTITIES_FOR_SERVICE_SQL = ' UNION ALL '.join(
+    f'''
+    {_entity_select(entity_type, 'e')}
+    JOIN koblinger k ON k.entity_id = e.id AND k.entity_type = '{entity_type}'
+    JOIN samhandlingstjeneter s ON s.id = k.samhandlingstjeneste_id
+    WHERE s.name = ?1
+    '''
+    for entity_type in ENTITY_TABLES
+) + ' ORDER BY 1, 2'
+
+SERVICES_FOR_ENTITY_SQL = '''
+SELECT s.name
+FROM koblinger k
+JOIN samhandlingstjeneter s ON s.id = k.samhandlingstjeneste_id
+WHERE k.entity_id = ? AND k.entity_type = ?
+ORDER BY s.name
+'''
+
+# Entities of a samhandlingstjeneste from tjeneste_oversikt, each prefixed
+# with the (informasjonstype, eif_niva) group it is listed under. The rows
+# come out of one primary key range scan, already in group order.
+SERVICE_OVERVIEW_SQL = f'''
+SELECT o.informasjonstype, o.niva, o.entity_type, o.entity_id,
+       {', '.join(f'o.{column}' for column in ENTITY_COLUMNS)}
+FROM tjeneste_oversikt o
+WHERE o.samhandlingstjeneste_id = (SELECT id FROM samhandlingstjeneter WHERE name = ?)
+ORDER BY o.informasjonstype, o.niva, o.entity_type, o.entity_id
+'''
+
+# The related entities of an entity's group, leaving out the entity itself
+RELATED_SQL = '''
+SELECT r.related_type, r.related_id, COALESCE(g.navn, c.navn), r.shared_services, r.jaccard
+FROM relaterte_grupper m
+JOIN relaterte_entiteter r ON r.group_id = m.group_id
+LEFT JOIN reguleringer g ON r.related_type = 'regulering' AND g.id = r.related_id
+LEFT JOIN komponenter c ON r.related_type = 'komponent' AND c.id = r.related_id
+WHERE m.entity_type = ?1 AND m.entity_id = ?2
+  AND NOT (r.related_type = ?1 AND r.related_id = ?2)
+ORDER BY r.rank
+LIMIT ?3
+'''
+
+# Latest change of each entity after a given build, from sqlite_builder's changelog
+CHANGES_SINCE_SQL = '''
+SELECT build_id, entity_type, entity_id, operation, content_hash
+FROM (
+  SELECT *, ROW_NUMBER() OVER (
+    PARTITION BY entity_type, entity_id ORDER BY build_id DESC) AS n
+  FROM changelog
+  WHERE build_id > ?
+)
+WHERE n = 1
+ORDER BY entity_type, entity_id
+'''
+
+LATEST_BUILD_SQL = 'SELECT MAX(id) FROM builds'
+
+# eif_niva can hold several comma-separated levels. They are split like
+# sqlite_builder.split_levels, with or without spaces after the commas, and
+# compared whole, so % or _ in the requested level match only themselves.
+EIF_NIVA_MATCH = '''EXISTS (
+  WITH RECURSIVE items (item, rest) AS (
+    SELECT NULL, e.eif_niva || ','
+    UNION ALL
+    SELECT trim(substr(rest, 1, instr(rest, ',') - 1), ' ' || char(9, 10, 11, 12, 13)),
+           substr(rest, instr(rest, ',') + 1)
+    FROM items WHERE rest != ''
+  )
+  SELECT 1 FROM items WHERE item = ? AND item != ''
+)'''
+
+# Dictionary-encoded databases keep the split levels in eif_koblinger
+def _encoded_level_match(entity_type):
+    return f'''e.id IN (
+      SELECT entity_id FROM eif_koblinger
+      WHERE eif_niva_id = (SELECT id FROM eif_nivaer WHERE navn = ?) AND entity_type = '{entity_type}'
+    )'''
+
+def _filter_sql(by_status, by_level, encoded=False):
+    def where(entity_type):
+        conditions = []
+        if by_status:
+            conditions.append('e.status = ?')
+        if by_level:
+            conditions.append(_encoded_level_match(entity_type) if encoded else EIF_NIVA_MATCH)
+        return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return ' UNION ALL '.join(
+        f'{_entity_select(entity_type, "e")} {where(entity_type)}' for entity_type in ENTITY_TABLES
+    ) + ' ORDER BY 1, 2'
+
+# One statement per combination of filters, so a given status is an index
+# seek instead of an "IS NULL OR" condition that forces a table scan
+FILTER_BY_STATUS_AND_LEVEL_SQL = {
+    (by_status, by_level): _filter_sql(by_status, by_level)
+    for by_status in (False, True)
+    for by_level in (False, True)
+}
+ENCODED_FILTER_BY_STATUS_AND_LEVEL_SQL = {
+    (by_status, by_level): _filter_sql(by_status, by_level, encoded=True)
+    for by_status in (False, True)
+    for by_level in (False, True)
+}
+
+# Whether the database was dictionary-encoded with the eif_koblinger junction table
+ENCODED_SQL = "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'eif_koblinger')"
+
+# Dictionary-encoded databases only: compare the eif_mask bitmask against the
+# bits of the requested levels, passed as a JSON array
+EIF_LEVEL_NAMES_SQL = 'SELECT navn FROM eif_nivaer'
+_LEVEL_MASK = '(SELECT COALESCE(SUM(bit), 0) FROM eif_nivaer WHERE navn IN (SELECT value FROM json_each(?1)))'
+ENTITIES_WITH_LEVELS_SQL = {
+    match_all: ' UNION ALL '.join(
+        f'''
+        {_entity_select(entity_type, 'e')}
+        JOIN {table}_data d ON d.id = e.id
+        WHERE {f'd.eif_mask & {_LEVEL_MASK} = {_LEVEL_MASK}' if match_all else f'd.eif_mask & {_LEVEL_MASK} != 0'}
+        '''
+        for entity_type, table in ENTITY_TABLES.items()
+    ) + ' ORDER BY 1, 2'
+    for match_all in (False, True)
+}
+
+# How readers reach the database: straight from the file, from the file
+# through a large memory map, or from an in-memory copy
+SERVING_MODES = ('file', 'mmap', 'memory')
+
+# mmap_size used in 'mmap' serving mode
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Names for the in-memory copies, unique within the process
+_memory_generations = itertools.count(1)
+
+class RegulationQueries:
+    """
+    Read-only lookups against a regulations database. Each thread gets its
+    own connection, and results are kept in an LRU cache that is dropped
+    whenever the database file changes on disk.
+
+    In 'memory' serving mode the file is copied into a shared-cache
+    in-memory database with the backup API. When the file changes, a fresh
+    copy is loaded and readers switch to it on their next lookup, so a
+    rebuild is picked up atomically and lookups never read from disk.
+    """
+
+    def __init__(self, db_file, cache_size=CACHE_SIZE, serving='file'):
+        if serving not in SERVING_MODES:
+            raise ValueError(f"Unknown serving mode: {serving}")
+        self.db_file = db_file
+        self.cache_size = cache_size
+        self.serving = serving
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_signature = None
+        self._lock = threading.Lock()
+        # (signature, uri, holder connection) of the current in-memory copy
+        self._memory = None
+        self._memory_lock = threading.Lock()
+
+    def _signature(self):
+        """Identify the current version of the database file"""
+        stat = os.stat(self.db_file)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _load_memory_copy(self, signature):
+        """Copy the database file into a new in-memory database"""
+        uri = f'file:regulations-{next(_memory_generations)}?mode=memory&cache=shared'
+        # The holder keeps the in-memory database alive between readers
+        holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(f'file:{self.db_file}?mode=ro', uri=True)
+        source.backup(holder)
+        source.close()
+        return signature, uri, holder
+
+    def _memory_uri(self, signature):
+        """Return the URI of the in-memory copy matching signature"""
+        with self._memory_lock:
+            if self._memory is None or self._memory[0] != signature:
+                previous = self._memory
+                self._memory = self._load_memory_copy(signature)
+                # Readers still on the old copy keep it alive until they reconnect
+                if previous is not None:
+                    previous[2].close()
+            return self._memory[1]
+
+    def _connection(self, signature):
+        """Return this thread's connection, reopening it if the file changed"""
+        local = self._local
+        if getattr(local, 'signature', None) != signature:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            if self.serving == 'memory':
+                local.conn = sqlite3.connect(
+                    self._memory_uri(signature), uri=True,
+                    cached_statements=CACHED_STATEMENTS)
+                local.conn.execute('PRAGMA query_only = ON')
+            else:
+                local.conn = sqlite3.connect(
+                    f'file:{self.db_file}?mode=ro', uri=True,
+                    cached_statements=CACHED_STATEMENTS)
+                if self.serving == 'mmap':
+                    local.conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+            local.signature = signature
+        return local.conn
+
+    def _query(self, sql, params, row_factory):
+        signature = self._signature()
+        key = (sql, params)
+
+        with self._lock:
+            if signature != self._cache_signature:
+                self._cache.clear()
+                self._cache_signature = signature
+            elif key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        rows = self._connection(signature).execute(sql, params).fetchall()
+        result = tuple(row_factory(row) for row in rows)
+
+        with self._lock:
+            if signature == self._cache_signature:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def clear_cache(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._cache.clear()
+
+    def entities_for_service(self, service: str) -> Tuple[Entity, ...]:
+        """All reguleringer and komponenter linked to a samhandlingstjeneste"""
+        return self._query(ENTITIES_FOR_SERVICE_SQL, (service,), Entity._make)
+
+    def services_for_entity(self, entity_type: str, entity_id: int) -> Tuple[str, ...]:
+        """Names of the samhandlingstjenester an entity is linked to"""
+        if entity_type not in ENTITY_TABLES:
+            raise ValueError(f"Unknown entity type: {entity_type}")
+        return self._query(SERVICES_FOR_ENTITY_SQL, (entity_id, entity_type), lambda row: row[0])
+
+    def filter_by_status_and_level(self, status: Optional[str] = None,
+                                   eif_niva: Optional[str] = None) -> Tuple[Entity, ...]:
+        """Entities with the given status and EIF level; None matches any"""
+        encoded = self._query(ENCODED_SQL, (), lambda row: row[0])[0]
+        statements = ENCODED_FILTER_BY_STATUS_AND_LEVEL_SQL if encoded else FILTER_BY_STATUS_AND_LEVEL_SQL
+        sql = statements[(status is not None, eif_niva is not None)]
+        params = tuple(value for value in (status, eif_niva) if value is not None)
+        # Both branches of the UNION take the same parameters
+        return self._query(sql, params * len(ENTITY_TABLES), Entity._make)
+
+    def entities_with_levels(self, levels: Sequence[str], match_all: bool = True) -> Tuple[Entity, ...]:
+        """
+        Entities tagged with all (or, with match_all=False, any) of the given
+        EIF levels. Needs a database built with sqlite_builder --encoded.
+        Raises ValueError for an empty or unknown level.
+        """
+        if not levels:
+            raise ValueError("No EIF levels given")
+        unknown = set(levels) - set(self._query(EIF_LEVEL_NAMES_SQL, (), lambda row: row[0]))
+        if unknown:
+            raise ValueError(f"Unknown EIF levels: {', '.join(sorted(unknown))}")
+        params = (json.dumps(sorted(levels), ensure_ascii=False),)
+        return self._query(ENTITIES_WITH_LEVELS_SQL[match_all], params, Entity._make)
+
+    def service_overview(self, service: str) -> Optional[str]:
+        """
+        JSON overview of a samhandlingstjeneste with its entities grouped by
+        informasjonstype and EIF level, read from the precomputed
+        tjeneste_oversikt table, or None for an unknown service
+        """
+        rows = self._query(SERVICE_OVERVIEW_SQL, (service,), tuple)
+        if not rows:
+            return None
+        groups = [
+            {'informasjonstype': info_type or None, 'eif_niva': level or None,
+             'elementer': [Entity._make(row[2:])._asdict() for row in members]}
+            for (info_type, level), members in itertools.groupby(rows, key=lambda row: row[:2])
+        ]
+        return json.dumps({'samhandlingstjeneste': service, 'grupper': groups}, ensure_ascii=False)
+
+    def related_entities(self, entity_type: str, entity_id: int, limit: int = 10) -> Tuple[Related, ...]:
+        """
+        Entities sharing the most samhandlingstjenester with the given one,
+        read from the precomputed relaterte_entiteter table
+        """
+        if entity_type not in ENTITY_TABLES:
+            raise ValueError(f"Unknown entity type: {entity_type}")
+        return self._query(RELATED_SQL, (entity_type, entity_id, limit), Related._make)
+
+    def latest_build(self) -> Optional[int]:
+        """Id of the build that produced the database, or None"""
+        return self._query(LATEST_BUILD_SQL, (), lambda row: row[0])[0]
+
+    def changes_since(self, build_id: int) -> Tuple[Change, ...]:
+        """
+        Entities inserted, updated or deleted by builds after build_id, with
+        only the latest change of each entity. Pass 0 to get every entity.
+        A consumer stores latest_build() and asks for the changes since it.
+        """
+        return self._query(CHANGES_SINCE_SQL, (build_id,), Change._make)
+
+def benchmark(queries, lookup, args, iterations=1000):
+    """
+    Time a lookup without and with the result cache, in microseconds per call
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        queries.clear_cache()
+        lookup(*args)
+    uncached = (time.perf_counter() - start) / iterations * 1e6
+
+    lookup(*args)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        lookup(*args)
+    cached = (time.perf_counter() - start) / iterations * 1e6
+
+    return uncached, cached
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python regulation_queries.py database.db [file|mmap|memory]")
+        sys.exit(1)
+
+    queries = RegulationQueries(sys.argv[1], serving=sys.argv[2] if len(sys.argv) == 3 else 'file')
+    conn = sqlite3.connect(f'file:{sys.argv[1]}?mode=ro', uri=True)
+    service = conn.execute('SELECT name FROM samhandlingstjeneter ORDER BY id LIMIT 1').fetchone()[0]
+    entity_id = conn.execute('SELECT MIN(id) FROM reguleringer').fetchone()[0]
+    conn.close()
+
+    lookups = [
+        ('entities_for_service', queries.entities_for_service, (service,)),
+        ('services_for_entity', queries.services_for_entity, ('regulering', entity_id)),
+        ('filter_by_status_and_level', queries.filter_by_status_and_level, ('Eksisterer', 'Semantisk')),
+        ('service_overview', queries.service_overview, (service,)),
+        ('related_entities', queries.related_entities, ('regulering', entity_id)),
+    ]
+
+    for name, lookup, args in lookups:
+        uncached, cached = benchmark(queries, lookup, args)
+        result = lookup(*args)
+        rows = len(result) if isinstance(result, tuple) else int(result is not None)
+        print(f"{name:28} {rows:5} rows  "
+              f"uncached {uncached:8.1f} us  cached {cached:6.1f} us")
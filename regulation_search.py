@@ -0,0 +1,77 @@
+import sqlite3
+import time
+
+from sqlite_builder import ENTITY_TABLES
+
+# bm25 column weights, in FULLTEXT_COLUMNS order: a hit in navn counts
+# more than one in ingress, which counts more than the longer descriptions
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+
+def connect(db_file):
+    """
+    Open the database read-only
+    """
+    return sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression. Every term is quoted so
+    characters like '-' and ':' are not read as query syntax, and the last
+    term matches as a prefix.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search(conn, text, limit=20, entity_type=None):
+    """
+    Search reguleringer and komponenter, returning bm25-ranked hits with a
+    snippet of the best matching column. Lower scores rank higher.
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    selects = []
+    params = []
+    for current_type, table in ENTITY_TABLES.items():
+        if entity_type and entity_type != current_type:
+            continue
+        fts = f'fulltekst_{table}'
+        selects.append(f'''
+        SELECT '{current_type}' AS entity_type, e.id, e.informasjonstype, e.navn,
+               bm25({fts}, {weights}) AS score,
+               snippet({fts}, -1, '[', ']', '…', 12) AS snippet
+        FROM {fts} JOIN {table} e ON e.id = {fts}.rowid
+        WHERE {fts} MATCH ?
+        ''')
+        params.append(match)
+
+    cursor = conn.execute(
+        ' UNION ALL '.join(selects) + ' ORDER BY score LIMIT ?', params + [limit])
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python regulation_search.py database.db search terms")
+        sys.exit(1)
+
+    conn = connect(sys.argv[1])
+    query = ' '.join(sys.argv[2:])
+
+    start = time.perf_counter()
+    hits = search(conn, query)
+    elapsed = time.perf_counter() - start
+
+    for hit in hits:
+        print(f"{hit['score']:7.2f}  {hit['entity_type']:10}  {hit['navn']}")
+        print(f"         {hit['snippet']}")
+    print(f"{len(hits)} hits in {elapsed * 1000:.1f} ms")
+
+    conn.close()
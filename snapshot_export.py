@@ -0,0 +1,106 @@
+import os
+import sqlite3
+
+from sqlite_builder import ENTITY_COLUMNS, ENTITY_TABLES, DICTIONARY_COLUMNS
+
+# Columns stored as Arrow dictionaries (categoricals in pandas)
+CATEGORICAL_COLUMNS = ['entity_type', 'eif_niva', 'samhandlingstjeneste'] + list(DICTIONARY_COLUMNS)
+
+FORMATS = ('parquet', 'arrow')
+
+def read_entities(conn):
+    """
+    Read reguleringer and komponenter into one list of column lists
+    """
+    columns = ['entity_type', 'id'] + ENTITY_COLUMNS
+    rows = []
+    for entity_type, table in ENTITY_TABLES.items():
+        rows.extend(conn.execute(
+            f"SELECT '{entity_type}', id, {', '.join(ENTITY_COLUMNS)} FROM {table} ORDER BY id"))
+    return columns, rows
+
+def read_koblinger(conn):
+    """
+    Read koblinger exploded to one row per entity and samhandlingstjeneste,
+    with the entity columns repeated on each row
+    """
+    columns = ['entity_type', 'id'] + ENTITY_COLUMNS + ['samhandlingstjeneste']
+    rows = []
+    for entity_type, table in ENTITY_TABLES.items():
+        rows.extend(conn.execute(f'''
+        SELECT '{entity_type}', e.id, {', '.join(f'e.{column}' for column in ENTITY_COLUMNS)}, s.name
+        FROM {table} e
+        JOIN koblinger k ON k.entity_id = e.id AND k.entity_type = '{entity_type}'
+        JOIN samhandlingstjeneter s ON s.id = k.samhandlingstjeneste_id
+        ORDER BY e.id, s.name
+        '''))
+    return columns, rows
+
+def to_arrow_table(pa, columns, rows):
+    """
+    Build an Arrow table, dictionary-encoding the categorical columns
+    """
+    arrays = []
+    for i, column in enumerate(columns):
+        array = pa.array([row[i] for row in rows])
+        if column in CATEGORICAL_COLUMNS:
+            array = array.dictionary_encode()
+        arrays.append(array)
+    return pa.table(arrays, names=columns)
+
+def export_snapshot(db_file, output_dir, fmt='parquet'):
+    """
+    Write entiteter and koblinger snapshots of the database to output_dir as
+    Parquet files or uncompressed Arrow IPC files. Arrow files can be opened
+    zero-copy with pyarrow.memory_map. Files are replaced atomically.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Snapshot export needs pyarrow: pip install pyarrow")
+
+    os.makedirs(output_dir, exist_ok=True)
+    conn = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+
+    # Read both tables in one transaction so they match
+    conn.execute('BEGIN')
+    tables = {
+        'entiteter': to_arrow_table(pa, *read_entities(conn)),
+        'koblinger': to_arrow_table(pa, *read_koblinger(conn)),
+    }
+    conn.close()
+
+    for name, table in tables.items():
+        path = os.path.join(output_dir, f'{name}.{fmt}')
+        tmp_path = path + '.tmp'
+        if fmt == 'parquet':
+            pq.write_table(table, tmp_path)
+        else:
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        print(f"Wrote {table.num_rows} rows to {path}")
+
+def load_snapshot(path):
+    """
+    Load a snapshot file as an Arrow table. Arrow IPC files are memory-mapped.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith('.arrow'):
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return pq.read_table(path)
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python snapshot_export.py database.db output_dir [parquet|arrow]")
+        sys.exit(1)
+
+    export_snapshot(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else 'parquet')
@@ -1,199 +1,1652 @@
+import bisect
 import csv
 import sqlite3
 import os
+import time
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import io
+import sys
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def create_database(csv_file, db_file):
+from compressed_io import open_stream
+
+# List of informasjonstype values for komponenter
+KOMPONENT_TYPES = frozenset([
+    "Nasjonal e-helseløsning",
+    "Teknisk grensesnitt",
+    "Samhandlingskomponent",
+    "Informasjonslager",
+    "Informasjonstjeneste"
+])
+
+# Columns shared by reguleringer and komponenter, in insert order
+ENTITY_COLUMNS = [
+    'informasjonstype', 'navn', 'ingress', 'beskrivelse',
+    'kontekstavhengig_beskrivelse', 'normeringsniva', 'eif_niva',
+    'status', 'ansvarlig', 'referanse_lenketekst', 'referanse_url'
+]
+
+SCHEMA = '''
+-- Main table for regulatory information
+CREATE TABLE reguleringer (
+  id INTEGER PRIMARY KEY,
+  informasjonstype TEXT,
+  navn TEXT NOT NULL,
+  ingress TEXT,
+  beskrivelse TEXT,
+  kontekstavhengig_beskrivelse TEXT,
+  normeringsniva TEXT,
+  eif_niva TEXT,
+  status TEXT,
+  ansvarlig TEXT,
+  referanse_lenketekst TEXT,
+  referanse_url TEXT
+);
+
+-- Table for component information
+CREATE TABLE komponenter (
+  id INTEGER PRIMARY KEY,
+  informasjonstype TEXT,
+  navn TEXT NOT NULL,
+  ingress TEXT,
+  beskrivelse TEXT,
+  kontekstavhengig_beskrivelse TEXT,
+  normeringsniva TEXT,
+  eif_niva TEXT,
+  status TEXT,
+  ansvarlig TEXT,
+  referanse_lenketekst TEXT,
+  referanse_url TEXT
+);
+
+-- Table for collaboration services (samhandlingstjenester)
+CREATE TABLE samhandlingstjeneter (
+  id INTEGER PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL
+);
+
+-- Junction table to represent the many-to-many relationship
+-- between reguleringer and services
+CREATE TABLE koblinger (
+  entity_id INTEGER,
+  entity_type TEXT,  -- 'regulering' or 'komponent'
+  samhandlingstjeneste_id INTEGER,
+  PRIMARY KEY (entity_id, entity_type, samhandlingstjeneste_id),
+  FOREIGN KEY (samhandlingstjeneste_id) REFERENCES samhandlingstjeneter(id) ON DELETE CASCADE
+);
+
+-- Natural key and content hash of each entity, used by incremental updates
+CREATE TABLE entity_keys (
+  entity_type TEXT NOT NULL,
+  natural_key TEXT NOT NULL,
+  entity_id INTEGER NOT NULL,
+  content_hash TEXT NOT NULL,
+  PRIMARY KEY (entity_type, natural_key)
+);
+
+-- Information about the build, such as its build_hash
+CREATE TABLE metadata (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+
+-- One row per run of sqlite_builder, full or incremental
+CREATE TABLE builds (
+  id INTEGER PRIMARY KEY,
+  build_hash TEXT NOT NULL,
+  kind TEXT NOT NULL,  -- 'full' or 'incremental'
+  created_at TEXT NOT NULL
+);
+
+-- Entities inserted, updated or deleted by each build, so consumers can
+-- reprocess only what changed since the last build they saw
+CREATE TABLE changelog (
+  build_id INTEGER NOT NULL,
+  entity_type TEXT NOT NULL,
+  entity_id INTEGER NOT NULL,
+  operation TEXT NOT NULL,  -- 'insert', 'update' or 'delete'
+  content_hash TEXT,  -- hash of the new contents, or of the deleted contents
+  PRIMARY KEY (build_id, entity_type, entity_id),
+  FOREIGN KEY (build_id) REFERENCES builds(id)
+);
+'''
+
+# Indexes for better query performance. The status indexes also carry
+# eif_niva so status + level filters are answered from the index.
+INDEXES = [
+    'CREATE INDEX idx_reguleringer_type ON reguleringer(informasjonstype)',
+    'CREATE INDEX idx_reguleringer_status ON reguleringer(status, eif_niva)',
+    'CREATE INDEX idx_reguleringer_ansvarlig ON reguleringer(ansvarlig)',
+
+    'CREATE INDEX idx_komponenter_type ON komponenter(informasjonstype)',
+    'CREATE INDEX idx_komponenter_status ON komponenter(status, eif_niva)',
+    'CREATE INDEX idx_komponenter_ansvarlig ON komponenter(ansvarlig)',
+
+    # The primary key only serves entity -> services lookups. This covers
+    # the reverse direction without touching the table.
+    'CREATE INDEX idx_koblinger_tjeneste ON koblinger(samhandlingstjeneste_id, entity_type, entity_id)',
+]
+
+# PRAGMAs used while bulk loading. The database is built in a temporary
+# file that is renamed into place afterwards, so the load itself does not
+# need to be durable.
+BULK_PRAGMAS = '''
+PRAGMA journal_mode = MEMORY;
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA locking_mode = EXCLUSIVE;
+'''
+
+# PRAGMAs used by the streaming build. The page cache is capped, and
+# temporary tables and the rollback journal spill to disk, so memory stays
+# flat however large the input is, even when reused ids move every row.
+STREAM_PRAGMAS = '''
+PRAGMA journal_mode = TRUNCATE;
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = FILE;
+PRAGMA cache_size = -16384;
+PRAGMA locking_mode = EXCLUSIVE;
+'''
+
+# Number of CSV rows parsed before a batch is written with executemany
+BATCH_SIZE = 5000
+
+# Number of CSV rows per transaction in the streaming build
+CHUNK_SIZE = 100000
+
+# Number of CSV records sent to a worker at a time in the parallel build
+PARTITION_SIZE = 10000
+
+ENTITY_TABLES = {'regulering': 'reguleringer', 'komponent': 'komponenter'}
+
+# metadata keys holding the highest id ever handed out for each entity type
+# and for samhandlingstjeneter, so ids of deleted rows are not reused
+LAST_ID_KEYS = {
+    'regulering': 'last_regulering_id',
+    'komponent': 'last_komponent_id',
+    'samhandlingstjeneste': 'last_samhandlingstjeneste_id',
+}
+
+# Low-cardinality columns moved to lookup tables by encode_database
+DICTIONARY_COLUMNS = {
+    'informasjonstype': 'informasjonstyper',
+    'normeringsniva': 'normeringsnivaer',
+    'status': 'statuser',
+    'ansvarlig': 'ansvarlige',
+}
+
+# EIF levels in bit order for the encoded eif_mask column
+EIF_LEVELS = ['Juridisk', 'Organisatorisk', 'Semantisk', 'Teknisk']
+
+ENCODED_INDEXES = [
+    'CREATE INDEX idx_reguleringer_data_type ON reguleringer_data(informasjonstype_id)',
+    'CREATE INDEX idx_reguleringer_data_status ON reguleringer_data(status_id, eif_mask)',
+    'CREATE INDEX idx_reguleringer_data_ansvarlig ON reguleringer_data(ansvarlig_id)',
+
+    'CREATE INDEX idx_komponenter_data_type ON komponenter_data(informasjonstype_id)',
+    'CREATE INDEX idx_komponenter_data_status ON komponenter_data(status_id, eif_mask)',
+    'CREATE INDEX idx_komponenter_data_ansvarlig ON komponenter_data(ansvarlig_id)',
+]
+
+# Number of related entities kept per entity in relaterte_entiteter
+RELATED_LIMIT = 20
+
+# Samhandlingstjenester linked to more than this share of all entities are
+# too common to make two entities related
+RELATED_MAX_SERVICE_SHARE = 0.5
+
+# Groups read from the service postings that one lookup of the groups linked
+# to a combination of services is worth when ranking related entities
+SUBSET_LOOKUP_COST = 8
+
+# Entities of each samhandlingstjeneste grouped by informasjonstype and EIF
+# level, one row per entity and level with copies of the entity columns, so
+# an overview is a primary key range scan without joins. niva is the single
+# level the row is listed under, '' for a missing one; eif_niva is the
+# entity's own value.
+SERVICE_OVERVIEW_SCHEMA = '''
+CREATE TABLE tjeneste_oversikt (
+  samhandlingstjeneste_id INTEGER NOT NULL,
+  informasjonstype TEXT NOT NULL,
+  niva TEXT NOT NULL,
+  entity_type TEXT NOT NULL,
+  entity_id INTEGER NOT NULL,
+  navn TEXT NOT NULL,
+  ingress TEXT,
+  beskrivelse TEXT,
+  kontekstavhengig_beskrivelse TEXT,
+  normeringsniva TEXT,
+  eif_niva TEXT,
+  status TEXT,
+  ansvarlig TEXT,
+  referanse_lenketekst TEXT,
+  referanse_url TEXT,
+  PRIMARY KEY (samhandlingstjeneste_id, informasjonstype, niva, entity_type, entity_id)
+) WITHOUT ROWID
+'''
+
+# Entities with the same samhandlingstjenester share their related
+# entities, so those are stored once per group: the top RELATED_LIMIT + 1
+# by the number of services shared and the Jaccard similarity of the full
+# service sets, the entity itself included
+RELATED_GROUPS_SCHEMA = '''
+CREATE TABLE relaterte_grupper (
+  entity_type TEXT NOT NULL,
+  entity_id INTEGER NOT NULL,
+  group_id INTEGER NOT NULL,
+  PRIMARY KEY (entity_type, entity_id)
+) WITHOUT ROWID
+'''
+
+RELATED_GROUPS_INSERT = 'INSERT INTO relaterte_grupper (entity_type, entity_id, group_id) VALUES (?, ?, ?)'
+
+RELATED_SCHEMA = '''
+CREATE TABLE relaterte_entiteter (
+  group_id INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  related_type TEXT NOT NULL,
+  related_id INTEGER NOT NULL,
+  shared_services INTEGER NOT NULL,
+  jaccard REAL NOT NULL,
+  PRIMARY KEY (group_id, rank)
+) WITHOUT ROWID
+'''
+
+# Text columns indexed for full-text search. Diacritics are not removed, so
+# æ, ø and å stay distinct letters as in Norwegian: "år" does not match
+# "ar" and "prøvesvar" does not match "provesvar"
+FULLTEXT_COLUMNS = ['navn', 'ingress', 'beskrivelse', 'kontekstavhengig_beskrivelse']
+FULLTEXT_TOKENIZER = 'unicode61 remove_diacritics 0'
+
+def clean(value):
+    """
+    Strip a CSV value, returning None for empty values
+    """
+    return value.strip() if value else None
+
+def split_services(services_raw):
+    """
+    Split the comma-separated samhandlingstjenester value into service names
+    """
+    if not services_raw:
+        return []
+
+    # Strip quotes if they exist
+    if services_raw.startswith('"') and services_raw.endswith('"'):
+        services_raw = services_raw[1:-1]
+
+    # A service listed twice on one row would violate the koblinger key
+    return list(dict.fromkeys(s.strip() for s in services_raw.split(',')))
+
+def split_levels(eif_niva):
+    """
+    Split the comma-separated eif_niva value into level names
+    """
+    if not eif_niva:
+        return []
+    return list(dict.fromkeys(filter(None, (level.strip() for level in eif_niva.split(',')))))
+
+def parse_row(row):
+    """
+    Normalize a CSV row into (entity_type, values, services), where values
+    follow ENTITY_COLUMNS
+    """
+    info_type = row['informasjonstype'].strip()
+    entity_type = 'komponent' if info_type in KOMPONENT_TYPES else 'regulering'
+
+    values = (info_type, row['navn'].strip()) + tuple(
+        clean(row[column]) for column in ENTITY_COLUMNS[2:])
+
+    return entity_type, values, split_services(row['samhandlingstjenester'])
+
+def record_parser(header):
+    """
+    Return a function that normalizes a csv.reader record like parse_row,
+    using column positions resolved once from the header
+    """
+    positions = [header.index(column) for column in ENTITY_COLUMNS]
+    services_position = header.index('samhandlingstjenester')
+    info_type_position, navn_position = positions[0], positions[1]
+    optional_positions = positions[2:]
+
+    def parse(record):
+        info_type = record[info_type_position].strip()
+        entity_type = 'komponent' if info_type in KOMPONENT_TYPES else 'regulering'
+        values = (info_type, record[navn_position].strip()) + tuple(
+            clean(record[position]) for position in optional_positions)
+        return entity_type, values, split_services(record[services_position])
+
+    return parse
+
+def natural_key(values, seen):
+    """
+    Build a stable key from informasjonstype and navn. Rows repeating the
+    same pair are told apart by their order of appearance, tracked in seen.
+    """
+    key = f'{values[0]}\x1f{values[1]}'
+    seen[key] = seen.get(key, 0) + 1
+    return f'{key}\x1f{seen[key]}'
+
+def content_hash(values, services):
+    """
+    Hash the entity values and its linked services
+    """
+    payload = json.dumps([values, sorted(services)], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def create_indexes(cursor):
+    """
+    Create the secondary indexes
+    """
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+def create_fulltext_index(cursor):
+    """
+    Create an external-content FTS5 index over each entity table, filled
+    from the current rows and kept in sync by triggers
+    """
+    columns = ', '.join(FULLTEXT_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in FULLTEXT_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in FULLTEXT_COLUMNS)
+
+    for table in ENTITY_TABLES.values():
+        fts = f'fulltekst_{table}'
+        cursor.execute(f'''
+        CREATE VIRTUAL TABLE {fts} USING fts5(
+          {columns},
+          content = '{table}', content_rowid = 'id',
+          tokenize = '{FULLTEXT_TOKENIZER}', prefix = '2 3'
+        )
+        ''')
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+        cursor.execute(f'''
+        CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+          INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+          INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN
+          INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+          INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+        ''')
+
+def table_exists(cursor, name):
+    """
+    Check whether the database has a table with the given name
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def create_level_table(cursor):
+    """
+    Fill the temporary table eif_levels with the levels of every distinct
+    eif_niva value, split by split_levels, so SQL can join on single levels
+    """
+    cursor.execute('''
+    CREATE TEMP TABLE IF NOT EXISTS eif_levels (
+      eif_niva TEXT, level TEXT, PRIMARY KEY (eif_niva, level)
+    )
+    ''')
+    cursor.execute('DELETE FROM eif_levels')
+    values = set()
+    for table in ENTITY_TABLES.values():
+        cursor.execute(f'SELECT DISTINCT eif_niva FROM {table} WHERE eif_niva IS NOT NULL')
+        values.update(value for value, in cursor.fetchall())
+    cursor.executemany('INSERT INTO eif_levels (eif_niva, level) VALUES (?, ?)',
+                       [(value, level) for value in values for level in split_levels(value)])
+
+def refresh_service_overviews(cursor, service_ids=None):
+    """
+    Rebuild tjeneste_oversikt for the given samhandlingstjeneste ids, or for
+    all of them when service_ids is None. An entity with several EIF levels
+    is listed under each of them. Callers pass every service linked to an
+    entity that changed, since its columns are copied into the rows.
+    """
+    if service_ids is None:
+        cursor.execute('DROP TABLE IF EXISTS tjeneste_oversikt')
+        cursor.execute(SERVICE_OVERVIEW_SCHEMA)
+        service_filter = ''
+        params = ()
+    else:
+        # Also clears services that disappeared in an incremental update
+        service_list = json.dumps(sorted(service_ids))
+        cursor.execute('''
+        DELETE FROM tjeneste_oversikt
+        WHERE samhandlingstjeneste_id IN (SELECT value FROM json_each(?))
+        ''', (service_list,))
+        service_filter = 'AND k.samhandlingstjeneste_id IN (SELECT value FROM json_each(?))'
+        params = (service_list,)
+
+    columns = ', '.join(ENTITY_COLUMNS[1:])
+    entity_columns = ', '.join(f'e.{column}' for column in ENTITY_COLUMNS[1:])
+    create_level_table(cursor)
+    for entity_type, table in ENTITY_TABLES.items():
+        cursor.execute(f'''
+        INSERT INTO tjeneste_oversikt
+          (samhandlingstjeneste_id, informasjonstype, niva, entity_type, entity_id, {columns})
+        SELECT k.samhandlingstjeneste_id, COALESCE(e.informasjonstype, ''), COALESCE(l.level, ''),
+               k.entity_type, e.id, {entity_columns}
+        FROM koblinger k
+        JOIN {table} e ON e.id = k.entity_id
+        LEFT JOIN eif_levels l ON l.eif_niva = e.eif_niva
+        WHERE k.entity_type = '{entity_type}' {service_filter}
+        ''', params)
+
+def service_bits(mask):
+    """The single-service bits set in a service mask"""
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+def linked_to_all(subset, groups, postings, subsets):
+    """
+    Numbers of the groups linked to every service in subset, a tuple of
+    pairable service bits, in order. Worked out from the list of the subset
+    without its last service and kept in subsets, so groups asking for the
+    same services share the work.
+    """
+    if len(subset) == 1:
+        return postings[subset[0]]
+    found = subsets.get(subset)
+    if found is None:
+        last = subset[-1]
+        found = subsets[subset] = [other for other in linked_to_all(subset[:-1], groups, postings, subsets)
+                                   if groups[other][1] & last]
+    return found
+
+def related_in_order(number, groups, counts, members, postings, subsets):
+    """
+    Yield (entity, shared_services, jaccard) for the entities sharing a
+    pairable service with a group, best first. Groups are numbered by
+    service count, and are walked by the number of services they share and
+    then by number, so only as many are visited as the caller consumes.
+
+    The candidates sharing a number of services come from whichever reads
+    fewer groups: the groups with at least that many services, the groups
+    linked to each combination of that many of the group's services, or
+    counting the services shared with each group in the shortest postings
+    of its services. Combinations stop being cheaper as the services on a
+    row grow, so a row linked to many services reads each of its postings
+    at most once instead of 2^k lists.
+    """
+    mask, pairable = groups[number]
+    count = counts[number]
+    # Rarest services first, so the shortest postings and the smallest
+    # subset lists come first
+    ordered = sorted(service_bits(pairable), key=lambda bit: (len(postings[bit]), bit))
+    lists = [postings[bit] for bit in ordered]
+    common = count - len(ordered)
+
+    def sharing(size, shared, subset):
+        return (other for other in linked_to_all(subset, groups, postings, subsets)
+                if (groups[other][1] & pairable).bit_count() == size
+                and (groups[other][0] & mask).bit_count() == shared)
+
+    # Groups read from the first `read` postings, by the services they share
+    seen = set()
+    by_shared = {}
+    read = 0
+    for shared in range(count, 0, -1):
+        # A group sharing `shared` services shares at least `fewest`
+        # pairable ones, so it is in one of the shortest
+        # len(ordered) - fewest + 1 postings
+        fewest = max(1, shared - common)
+        if fewest > len(ordered):
+            continue
+        reach = len(ordered) - fewest + 1
+        sizes = range(fewest, min(shared, len(ordered)) + 1)
+        unread = sum(map(len, lists[read:reach]))
+        # Only groups with at least `shared` services can share that many
+        first = bisect.bisect_left(counts, shared)
+        if len(counts) - first <= unread:
+            candidates = (other for other in range(first, len(counts))
+                          if groups[other][1] & pairable and (groups[other][0] & mask).bit_count() == shared)
+        elif sum(math.comb(len(ordered), size) for size in sizes) * SUBSET_LOOKUP_COST <= unread:
+            # A group sharing exactly `size` pairable services is linked to
+            # one combination of that size
+            candidates = heapq.merge(*(sharing(size, shared, subset)
+                                       for size in sizes for subset in itertools.combinations(ordered, size)))
+        else:
+            for other in itertools.chain.from_iterable(lists[read:reach]):
+                if other not in seen:
+                    seen.add(other)
+                    by_shared.setdefault((groups[other][0] & mask).bit_count(), []).append(other)
+            read = reach
+            candidates = sorted(by_shared.pop(shared, ()))
+        for other_count, ties in itertools.groupby(candidates, key=counts.__getitem__):
+            jaccard = shared / (count + other_count - shared)
+            ties = list(ties)
+            for entity in heapq.merge(*(members[other] for other in ties)) if len(ties) > 1 else members[ties[0]]:
+                yield entity, shared, jaccard
+
+def build_related_entities(cursor, limit=RELATED_LIMIT, max_service_share=RELATED_MAX_SERVICE_SHARE):
+    """
+    Rebuild relaterte_grupper and relaterte_entiteter from koblinger.
+    Entities are scored by the number of samhandlingstjenester they share
+    and the Jaccard similarity of their full service sets. Services linked
+    to more than max_service_share of all entities count in both, but two
+    entities must also share a service that is not that common to be
+    related.
+
+    Entities with the same services have the same related entities, so they
+    form a group that is ranked once. Only the first limit + 1 members of a
+    group by (entity_type, entity_id) can make a top list, which leaves room
+    to drop the entity itself. Candidates come from postings of the groups
+    linked to each pairable service, so the cost grows with the groups
+    sharing a service rather than with the services on a row.
+    """
+    for name, schema in (('relaterte_grupper', RELATED_GROUPS_SCHEMA),
+                         ('relaterte_entiteter', RELATED_SCHEMA)):
+        cursor.execute(f'DROP TABLE IF EXISTS {name}')
+        cursor.execute(schema)
+
+    entity_count = 0
+    for table in ENTITY_TABLES.values():
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        entity_count += cursor.fetchone()[0]
+    cursor.execute('''
+    SELECT samhandlingstjeneste_id, COUNT(*) FROM koblinger
+    GROUP BY samhandlingstjeneste_id
+    ORDER BY samhandlingstjeneste_id
+    ''')
+    # Service sets are kept as bitmasks, with the pairable services in
+    # pairable_bits
+    service_bit = {}
+    pairable_bits = 0
+    for position, (service_id, links) in enumerate(cursor.fetchall()):
+        service_bit[service_id] = 1 << position
+        if links <= max_service_share * entity_count:
+            pairable_bits |= 1 << position
+
+    # (service mask, pairable service mask) of each group, its first
+    # members, and its number by service mask
+    groups = []
+    members = []
+    numbers = {}
+    wanted = limit + 1
+    writer = cursor.connection.cursor()
+    rows = []
+    for entity_type in sorted(ENTITY_TABLES):
+        # In entity_id order, so members come out sorted by (entity_type, entity_id)
+        cursor.execute('''
+        SELECT entity_id, samhandlingstjeneste_id FROM koblinger
+        WHERE entity_type = ?
+        ORDER BY entity_id
+        ''', (entity_type,))
+        for entity_id, links in itertools.groupby(cursor, key=lambda row: row[0]):
+            mask = sum(service_bit[service_id] for _, service_id in links)
+            if not mask & pairable_bits:
+                continue
+            number = numbers.get(mask)
+            if number is None:
+                number = numbers[mask] = len(groups)
+                groups.append((mask, mask & pairable_bits))
+                members.append([])
+            if len(members[number]) < wanted:
+                members[number].append((entity_type, entity_id))
+            rows.append((entity_type, entity_id, number + 1))
+            if len(rows) >= BATCH_SIZE:
+                writer.executemany(RELATED_GROUPS_INSERT, rows)
+                rows = []
+    writer.executemany(RELATED_GROUPS_INSERT, rows)
+
+    # Renumber the groups by service count, keeping their group ids, so
+    # postings in number order are in the order candidates are ranked in
+    order = sorted(range(len(groups)), key=lambda number: groups[number][0].bit_count())
+    group_ids = [number + 1 for number in order]
+    groups = [groups[number] for number in order]
+    members = [members[number] for number in order]
+    counts = [mask.bit_count() for mask, _ in groups]
+
+    # Numbers of the groups linked to each pairable service
+    postings = {}
+    for number, (_, pairable) in enumerate(groups):
+        for bit in service_bits(pairable):
+            postings.setdefault(bit, []).append(number)
+
+    subsets = {}
+    rows = []
+    for number in range(len(groups)):
+        ranked = itertools.islice(related_in_order(number, groups, counts, members, postings, subsets), wanted)
+        rows.extend(
+            (group_ids[number], rank, entity[0], entity[1], shared, jaccard)
+            for rank, (entity, shared, jaccard) in enumerate(ranked, 1)
+        )
+        if len(rows) >= BATCH_SIZE:
+            write_related(cursor, rows)
+            rows = []
+    write_related(cursor, rows)
+
+def write_related(cursor, rows):
+    cursor.executemany('''
+    INSERT INTO relaterte_entiteter
+      (group_id, rank, related_type, related_id, shared_services, jaccard)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+def write_build_hash(cursor):
+    """
+    Store a hash of the database contents in metadata. It covers entity ids
+    and content hashes plus samhandlingstjeneste ids, so two databases with
+    the same build_hash serve identical data.
+    """
+    digest = hashlib.sha1()
+    cursor.execute('SELECT entity_type, entity_id, content_hash FROM entity_keys ORDER BY entity_type, entity_id')
+    for row in cursor:
+        digest.update('\x1f'.join(map(str, row)).encode('utf-8') + b'\n')
+    cursor.execute('SELECT id, name FROM samhandlingstjeneter ORDER BY id')
+    for row in cursor:
+        digest.update('\x1f'.join(map(str, row)).encode('utf-8') + b'\n')
+
+    cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('build_hash', ?)",
+                   (digest.hexdigest(),))
+
+def read_last_ids(cursor, schema='main'):
+    """
+    The highest id handed out so far for each entity type and for
+    samhandlingstjeneter ('samhandlingstjeneste'), from the marks in
+    metadata. The live tables and changelog cover databases built before
+    the marks were kept.
+    """
+    cursor.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type IN ('table', 'view')")
+    tables = {name for name, in cursor.fetchall()}
+    last_ids = {}
+    for kind, table in dict(ENTITY_TABLES, samhandlingstjeneste='samhandlingstjeneter').items():
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {schema}.{table}')
+        last_ids[kind] = cursor.fetchone()[0]
+    if 'changelog' in tables:
+        cursor.execute(f'SELECT entity_type, MAX(entity_id) FROM {schema}.changelog GROUP BY entity_type')
+        for entity_type, entity_id in cursor.fetchall():
+            last_ids[entity_type] = max(last_ids[entity_type], entity_id)
+    if 'metadata' in tables:
+        for kind, key in LAST_ID_KEYS.items():
+            cursor.execute(f'SELECT value FROM {schema}.metadata WHERE key = ?', (key,))
+            row = cursor.fetchone()
+            if row is not None:
+                last_ids[kind] = max(last_ids[kind], int(row[0]))
+    return last_ids
+
+def write_last_ids(cursor, last_ids):
+    """Store the marks read_last_ids reads in metadata"""
+    cursor.executemany('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)',
+                       [(LAST_ID_KEYS[kind], str(last_id)) for kind, last_id in last_ids.items()])
+
+def record_build(cursor, kind):
+    """
+    Add a row to builds for the current build_hash and return its id
+    """
+    cursor.execute('''
+    INSERT INTO builds (build_hash, kind, created_at)
+    SELECT value, ?, strftime('%Y-%m-%dT%H:%M:%SZ', 'now') FROM metadata WHERE key = 'build_hash'
+    ''', (kind,))
+    return cursor.lastrowid
+
+def print_changes(cursor, build_id):
+    cursor.execute('SELECT operation, COUNT(*) FROM changelog WHERE build_id = ? GROUP BY operation',
+                   (build_id,))
+    counts = dict(cursor.fetchall())
+    print(f"Build {build_id}: {counts.get('insert', 0)} inserted, {counts.get('update', 0)} updated, "
+          f"{counts.get('delete', 0)} deleted")
+
+def attach_previous(cursor, previous_db):
+    """
+    Attach previous_db, the database a full build replaces, as 'previous'
+    and return the names of its tables, or an empty set when there is none.
+    Must be called outside a transaction.
+    """
+    if previous_db is None or not os.path.exists(previous_db):
+        return set()
+    cursor.execute('ATTACH DATABASE ? AS previous', (previous_db,))
+    cursor.execute("SELECT name FROM previous.sqlite_master WHERE type = 'table'")
+    return {name for name, in cursor.fetchall()}
+
+def renumber(cursor, table, column, mapping, condition=''):
+    """
+    Move column to new_id in every row whose value is an old_id of the
+    temporary table mapping. Values pass through their negatives first, so
+    a row never collides with one that has not moved yet.
+    """
+    cursor.execute(f'''
+    UPDATE {table} SET {column} = -(SELECT new_id FROM {mapping} WHERE old_id = {table}.{column})
+    WHERE {column} IN (SELECT old_id FROM {mapping}) {condition}
+    ''')
+    cursor.execute(f'UPDATE {table} SET {column} = -{column} WHERE {column} < 0 {condition}')
+
+def reuse_previous_ids(cursor, previous_tables):
+    """
+    Give the entities and samhandlingstjenester of a full build the ids they
+    had in the attached previous database, matching entities on their
+    natural key and services on their name. New ones are numbered after the
+    highest id the previous database ever handed out, as read_last_ids
+    reads it, so the id of a deleted entity or service is not handed out
+    again. The marks are carried over into metadata.
+    """
+    if 'entity_keys' not in previous_tables:
+        return
+
+    highest = read_last_ids(cursor, 'previous')
+
+    cursor.execute('CREATE TEMP TABLE id_map (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)')
+    for entity_type, table in ENTITY_TABLES.items():
+        cursor.execute('''
+        INSERT INTO id_map (old_id, new_id)
+        SELECT old_id, new_id FROM (
+          SELECT n.entity_id AS old_id,
+                 COALESCE(o.entity_id, ? + ROW_NUMBER() OVER (
+                   PARTITION BY o.entity_id IS NULL ORDER BY n.entity_id)) AS new_id
+          FROM entity_keys n
+          LEFT JOIN previous.entity_keys o
+            ON o.entity_type = n.entity_type AND o.natural_key = n.natural_key
+          WHERE n.entity_type = ?
+        )
+        WHERE old_id != new_id
+        ''', (highest[entity_type], entity_type))
+        renumber(cursor, table, 'id', 'id_map')
+        renumber(cursor, 'entity_keys', 'entity_id', 'id_map', f"AND entity_type = '{entity_type}'")
+        renumber(cursor, 'koblinger', 'entity_id', 'id_map', f"AND entity_type = '{entity_type}'")
+        cursor.execute('DELETE FROM id_map')
+
+    cursor.execute('''
+    INSERT INTO id_map (old_id, new_id)
+    SELECT old_id, new_id FROM (
+      SELECT n.id AS old_id,
+             COALESCE(o.id, ? + ROW_NUMBER() OVER (PARTITION BY o.id IS NULL ORDER BY n.id)) AS new_id
+      FROM samhandlingstjeneter n
+      LEFT JOIN previous.samhandlingstjeneter o ON o.name = n.name
+    )
+    WHERE old_id != new_id
+    ''', (highest['samhandlingstjeneste'],))
+    renumber(cursor, 'samhandlingstjeneter', 'id', 'id_map')
+    renumber(cursor, 'koblinger', 'samhandlingstjeneste_id', 'id_map')
+    cursor.execute('DROP TABLE id_map')
+
+    current = read_last_ids(cursor)
+    write_last_ids(cursor, {kind: max(highest[kind], current[kind]) for kind in LAST_ID_KEYS})
+
+def record_full_build(cursor, previous_tables):
+    """
+    Record a full build in builds and changelog. The history in the attached
+    previous database, the one being replaced, is carried over, and entities
+    are compared with its entity_keys by natural key and content hash.
+    previous_tables is what attach_previous returned; the database is
+    detached afterwards. Must be called outside a transaction.
+    """
+    cursor.execute('BEGIN')
+    if {'builds', 'changelog'} <= previous_tables:
+        cursor.execute('INSERT INTO builds SELECT * FROM previous.builds')
+        cursor.execute('INSERT INTO changelog SELECT * FROM previous.changelog')
+    build_id = record_build(cursor, 'full')
+
+    if 'entity_keys' in previous_tables:
+        cursor.execute('''
+        INSERT INTO changelog (build_id, entity_type, entity_id, operation, content_hash)
+        SELECT ?, n.entity_type, n.entity_id,
+               CASE WHEN o.entity_id IS NULL THEN 'insert' ELSE 'update' END, n.content_hash
+        FROM entity_keys n
+        LEFT JOIN previous.entity_keys o ON o.entity_type = n.entity_type AND o.natural_key = n.natural_key
+        WHERE o.content_hash IS NOT n.content_hash
+        ''', (build_id,))
+        cursor.execute('''
+        INSERT INTO changelog (build_id, entity_type, entity_id, operation, content_hash)
+        SELECT ?, o.entity_type, o.entity_id, 'delete', o.content_hash
+        FROM previous.entity_keys o
+        WHERE NOT EXISTS (
+          SELECT 1 FROM entity_keys n
+          WHERE n.entity_type = o.entity_type AND n.natural_key = o.natural_key
+        )
+        ''', (build_id,))
+    else:
+        cursor.execute('''
+        INSERT INTO changelog (build_id, entity_type, entity_id, operation, content_hash)
+        SELECT ?, entity_type, entity_id, 'insert', content_hash FROM entity_keys
+        ''', (build_id,))
+    cursor.execute('COMMIT')
+
+    cursor.execute("SELECT 1 FROM pragma_database_list WHERE name = 'previous'")
+    if cursor.fetchone():
+        cursor.execute('DETACH DATABASE previous')
+    print_changes(cursor, build_id)
+    return build_id
+
+# Search index and precomputed tables, built in this order once the base
+# tables are loaded
+DERIVED_TABLES = {
+    'fulltekst': create_fulltext_index,
+    'tjeneste_oversikt': refresh_service_overviews,
+    'relaterte_entiteter': build_related_entities,
+}
+
+def create_derived_tables(cursor, derived=None):
+    """
+    Build the derived tables named in derived, all of them when None, and
+    write the build hash. Returns the seconds spent on each table.
+    """
+    seconds = {}
+    for name in DERIVED_TABLES if derived is None else derived:
+        start = time.perf_counter()
+        DERIVED_TABLES[name](cursor)
+        seconds[name] = time.perf_counter() - start
+        print(f"Built {name} in {seconds[name]:.2f}s")
+    write_build_hash(cursor)
+    return seconds
+
+def print_statistics(cursor):
+    """
+    Print row counts for each table
+    """
+    cursor.execute('SELECT COUNT(*) FROM reguleringer')
+    reguleringer_count = cursor.fetchone()[0]
+
+    cursor.execute('SELECT COUNT(*) FROM komponenter')
+    komponenter_count = cursor.fetchone()[0]
+
+    cursor.execute('SELECT COUNT(*) FROM samhandlingstjeneter')
+    service_count = cursor.fetchone()[0]
+
+    cursor.execute('SELECT COUNT(*) FROM koblinger')
+    link_count = cursor.fetchone()[0]
+
+    print(f"Database created successfully with:")
+    print(f"- {reguleringer_count} reguleringer")
+    print(f"- {komponenter_count} komponenter")
+    print(f"- {service_count} unique samhandlingstjeneter")
+    print(f"- {link_count} koblinger")
+
+def create_database(csv_file, db_file, derived=None):
     """
     Create a SQLite database from the given CSV file
     """
-    # Remove the database file if it already exists
+    start = time.perf_counter()
+
+    # Move the existing database aside; its build history is carried over
+    previous_db = None
     if os.path.exists(db_file):
-        os.remove(db_file)
-    
+        previous_db = db_file + '.previous'
+        os.replace(db_file, previous_db)
+
     # Connect to the database
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
-    
+    previous_tables = attach_previous(cursor, previous_db)
+
     # Create the schema
-    cursor.executescript('''
-    -- Main table for regulatory information
-    CREATE TABLE reguleringer (
-      id INTEGER PRIMARY KEY,
-      informasjonstype TEXT,
-      navn TEXT NOT NULL,
-      ingress TEXT,
-      beskrivelse TEXT,
-      kontekstavhengig_beskrivelse TEXT,
-      normeringsniva TEXT,
-      eif_niva TEXT,
-      status TEXT,
-      ansvarlig TEXT,
-      referanse_lenketekst TEXT,
-      referanse_url TEXT
-    );
-    
-    -- Table for component information
-    CREATE TABLE komponenter (
-      id INTEGER PRIMARY KEY,
-      informasjonstype TEXT,
-      navn TEXT NOT NULL,
-      ingress TEXT,
-      beskrivelse TEXT,
-      kontekstavhengig_beskrivelse TEXT,
-      normeringsniva TEXT,
-      eif_niva TEXT,
-      status TEXT,
-      ansvarlig TEXT,
-      referanse_lenketekst TEXT,
-      referanse_url TEXT
-    );
-
-    -- Table for collaboration services (samhandlingstjenester)
-    CREATE TABLE samhandlingstjeneter (
-      id INTEGER PRIMARY KEY,
-      name TEXT UNIQUE NOT NULL
-    );
-
-    -- Junction table to represent the many-to-many relationship 
-    -- between reguleringer and services
-    CREATE TABLE koblinger (
-      entity_id INTEGER,
-      entity_type TEXT,  -- 'regulering' or 'komponent'
-      samhandlingstjeneste_id INTEGER,
-      PRIMARY KEY (entity_id, entity_type, samhandlingstjeneste_id),
-      FOREIGN KEY (samhandlingstjeneste_id) REFERENCES samhandlingstjeneter(id) ON DELETE CASCADE
-    );
-
-    -- Indexes for better query performance
-    CREATE INDEX idx_reguleringer_type ON reguleringer(informasjonstype);
-    CREATE INDEX idx_reguleringer_status ON reguleringer(status);
-    CREATE INDEX idx_reguleringer_ansvarlig ON reguleringer(ansvarlig);
-    
-    CREATE INDEX idx_komponenter_type ON komponenter(informasjonstype);
-    CREATE INDEX idx_komponenter_status ON komponenter(status);
-    CREATE INDEX idx_komponenter_ansvarlig ON komponenter(ansvarlig);
-    ''')
-    
+    cursor.executescript(SCHEMA)
+    create_indexes(cursor)
+
     # Dictionary to store service names and their IDs
     services_dict = {}
-    
-    # List of informasjonstype values for komponenter
-    komponent_types = [
-        "Nasjonal e-helseløsning", 
-        "Teknisk grensesnitt", 
-        "Samhandlingskomponent", 
-        "Informasjonslager", 
-        "Informasjonstjeneste"
-    ]
-    
+    seen_keys = {}
+    row_count = 0
+
+    placeholders = ', '.join('?' * len(ENTITY_COLUMNS))
+
     # Read the CSV file
-    with open(csv_file, 'r', encoding='utf-8') as f:
+    with open_stream(csv_file, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
-        
+
         # Process each row
         for row in reader:
-            info_type = row['informasjonstype'].strip()
-            
-            # Determine which table to insert into
-            if info_type in komponent_types:
-                # Insert into komponenter table
-                cursor.execute('''
-                INSERT INTO komponenter 
-                (informasjonstype, navn, ingress, beskrivelse, kontekstavhengig_beskrivelse, 
-                 normeringsniva, eif_niva, status, ansvarlig, referanse_lenketekst, referanse_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    info_type,
-                    row['navn'].strip(),
-                    row['ingress'].strip() if row['ingress'] else None,
-                    row['beskrivelse'].strip() if row['beskrivelse'] else None,
-                    row['kontekstavhengig_beskrivelse'].strip() if row['kontekstavhengig_beskrivelse'] else None,
-                    row['normeringsniva'].strip() if row['normeringsniva'] else None,
-                    row['eif_niva'].strip() if row['eif_niva'] else None,
-                    row['status'].strip() if row['status'] else None,
-                    row['ansvarlig'].strip() if row['ansvarlig'] else None,
-                    row['referanse_lenketekst'].strip() if row['referanse_lenketekst'] else None,
-                    row['referanse_url'].strip() if row['referanse_url'] else None
-                ))
-                entity_id = cursor.lastrowid
-                entity_type = 'komponent'
-            else:
-                # Insert into reguleringer table
+            entity_type, values, services = parse_row(row)
+            row_count += 1
+
+            # Insert into the komponenter or reguleringer table
+            cursor.execute(f'''
+            INSERT INTO {ENTITY_TABLES[entity_type]}
+            ({', '.join(ENTITY_COLUMNS)})
+            VALUES ({placeholders})
+            ''', values)
+            entity_id = cursor.lastrowid
+
+            cursor.execute('''
+            INSERT INTO entity_keys (entity_type, natural_key, entity_id, content_hash)
+            VALUES (?, ?, ?, ?)
+            ''', (entity_type, natural_key(values, seen_keys), entity_id, content_hash(values, services)))
+
+            for service in services:
+                # Add service if it doesn't exist
+                if service not in services_dict:
+                    cursor.execute('INSERT INTO samhandlingstjeneter (name) VALUES (?)', (service,))
+                    services_dict[service] = cursor.lastrowid
+
+                # Link entity to service
                 cursor.execute('''
-                INSERT INTO reguleringer 
-                (informasjonstype, navn, ingress, beskrivelse, kontekstavhengig_beskrivelse, 
-                 normeringsniva, eif_niva, status, ansvarlig, referanse_lenketekst, referanse_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    info_type,
-                    row['navn'].strip(),
-                    row['ingress'].strip() if row['ingress'] else None,
-                    row['beskrivelse'].strip() if row['beskrivelse'] else None,
-                    row['kontekstavhengig_beskrivelse'].strip() if row['kontekstavhengig_beskrivelse'] else None,
-                    row['normeringsniva'].strip() if row['normeringsniva'] else None,
-                    row['eif_niva'].strip() if row['eif_niva'] else None,
-                    row['status'].strip() if row['status'] else None,
-                    row['ansvarlig'].strip() if row['ansvarlig'] else None,
-                    row['referanse_lenketekst'].strip() if row['referanse_lenketekst'] else None,
-                    row['referanse_url'].strip() if row['referanse_url'] else None
-                ))
-                entity_id = cursor.lastrowid
-                entity_type = 'regulering'
-            
-            # Process samhandlingstjenester (comma-separated values)
-            if row['samhandlingstjenester']:
-                # Strip quotes if they exist
-                services_raw = row['samhandlingstjenester']
-                if services_raw.startswith('"') and services_raw.endswith('"'):
-                    services_raw = services_raw[1:-1]
-                
-                services = [s.strip() for s in services_raw.split(',')]
-                
-                for service in services:
-                    # Add service if it doesn't exist
-                    if service not in services_dict:
-                        cursor.execute('INSERT INTO samhandlingstjeneter (name) VALUES (?)', (service,))
-                        services_dict[service] = cursor.lastrowid
-                    
-                    # Link entity to service
-                    cursor.execute('''
-                    INSERT INTO koblinger (entity_id, entity_type, samhandlingstjeneste_id)
-                    VALUES (?, ?, ?)
-                    ''', (entity_id, entity_type, services_dict[service]))
-    
+                INSERT INTO koblinger (entity_id, entity_type, samhandlingstjeneste_id)
+                VALUES (?, ?, ?)
+                ''', (entity_id, entity_type, services_dict[service]))
+
+    reuse_previous_ids(cursor, previous_tables)
+    index_start = time.perf_counter()
+    derived_seconds = create_derived_tables(cursor, derived)
+    index_seconds = time.perf_counter() - index_start
+
     # Commit the changes
     conn.commit()
-    
+    record_full_build(cursor, previous_tables)
+    if previous_db is not None:
+        os.remove(previous_db)
+
     # Print some statistics
-    cursor.execute('SELECT COUNT(*) FROM reguleringer')
-    reguleringer_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM komponenter')
-    komponenter_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM samhandlingstjeneter')
-    service_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM koblinger')
-    link_count = cursor.fetchone()[0]
-    
-    print(f"Database created successfully with:")
-    print(f"- {reguleringer_count} reguleringer")
-    print(f"- {komponenter_count} komponenter")
-    print(f"- {service_count} unique samhandlingstjeneter")
-    print(f"- {link_count} koblinger")
-    
+    print_statistics(cursor)
+
     # Close the connection
     conn.close()
 
+    elapsed = time.perf_counter() - start
+    return {'rows': row_count, 'seconds': elapsed, 'index_seconds': index_seconds,
+            'derived_seconds': derived_seconds}
+
+def write_batch(cursor, entities, new_services, links):
+    """
+    Insert batched entity rows (keyed by entity_type, with explicit ids),
+    new samhandlingstjeneter and koblinger, then empty the batches
+    """
+    for entity_type, rows in entities.items():
+        cursor.executemany(f'''
+        INSERT INTO {ENTITY_TABLES[entity_type]} (id, {', '.join(ENTITY_COLUMNS)})
+        VALUES ({', '.join('?' * (len(ENTITY_COLUMNS) + 1))})
+        ''', rows)
+        rows.clear()
+    cursor.executemany('INSERT INTO samhandlingstjeneter (id, name) VALUES (?, ?)', new_services)
+    cursor.executemany('''
+    INSERT INTO koblinger (entity_id, entity_type, samhandlingstjeneste_id)
+    VALUES (?, ?, ?)
+    ''', links)
+    new_services.clear()
+    links.clear()
+
+def bulk_load_database(csv_file, db_file, batch_size=BATCH_SIZE, derived=None):
+    """
+    Create a SQLite database from the given CSV file using batched
+    executemany inserts in a single transaction. Indexes are created after
+    the load, and the finished file replaces db_file atomically.
+    """
+    start = time.perf_counter()
+
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    # Manage the transaction explicitly so the whole load is one BEGIN/COMMIT
+    conn = sqlite3.connect(tmp_file, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.executescript(BULK_PRAGMAS)
+    cursor.executescript(SCHEMA)
+    previous_tables = attach_previous(cursor, db_file)
+
+    # Entity and service ids are assigned here so links can be batched too
+    last_ids = {entity_type: 0 for entity_type in ENTITY_TABLES}
+    services_dict = {}
+    entities = {entity_type: [] for entity_type in ENTITY_TABLES}
+    new_services = []
+    links = []
+    keys = []
+    seen_keys = {}
+
+    def flush():
+        write_batch(cursor, entities, new_services, links)
+        cursor.executemany('''
+        INSERT INTO entity_keys (entity_type, natural_key, entity_id, content_hash)
+        VALUES (?, ?, ?, ?)
+        ''', keys)
+        keys.clear()
+
+    row_count = 0
+    cursor.execute('BEGIN')
+    try:
+        with open_stream(csv_file, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                entity_type, values, services = parse_row(row)
+
+                last_ids[entity_type] += 1
+                entity_id = last_ids[entity_type]
+                entities[entity_type].append((entity_id,) + values)
+                keys.append((entity_type, natural_key(values, seen_keys), entity_id,
+                             content_hash(values, services)))
+
+                for service in services:
+                    if service not in services_dict:
+                        services_dict[service] = len(services_dict) + 1
+                        new_services.append((services_dict[service], service))
+                    links.append((entity_id, entity_type, services_dict[service]))
+
+                row_count += 1
+                if row_count % batch_size == 0:
+                    flush()
+
+        flush()
+        reuse_previous_ids(cursor, previous_tables)
+        index_start = time.perf_counter()
+        create_indexes(cursor)
+        derived_seconds = create_derived_tables(cursor, derived)
+        index_seconds = time.perf_counter() - index_start
+        cursor.execute('COMMIT')
+        record_full_build(cursor, previous_tables)
+    except BaseException:
+        conn.close()
+        os.remove(tmp_file)
+        raise
+
+    print_statistics(cursor)
+    conn.close()
+    os.replace(tmp_file, db_file)
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/sec)")
+
+    return {'rows': row_count, 'seconds': elapsed, 'index_seconds': index_seconds,
+            'derived_seconds': derived_seconds}
+
+def peak_memory_mb():
+    """
+    Peak resident set size of this process in MB
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def stream_database(csv_file, db_file, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, raw=False,
+                    derived=None):
+    """
+    Create a SQLite database from a CSV file, or from stdin when csv_file is
+    '-', with memory that does not grow with the input. Records are read
+    positionally and committed every chunk_size rows. Natural key ordinals
+    are assigned in SQL after the load instead of in a Python dict.
+
+    With raw=True, csv_file is a raw export in any encoding. It is decoded
+    and column-filtered by csv_processor.read_export as it is loaded, with
+    no intermediate UTF-8 file.
+    """
+    start = time.perf_counter()
+
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    conn = sqlite3.connect(tmp_file, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.executescript(STREAM_PRAGMAS)
+    cursor.executescript(SCHEMA)
+    previous_tables = attach_previous(cursor, db_file)
+    cursor.execute('''
+    CREATE TEMP TABLE staged_keys (
+      entity_type TEXT, base_key TEXT, entity_id INTEGER, content_hash TEXT
+    )
+    ''')
+
+    last_ids = {entity_type: 0 for entity_type in ENTITY_TABLES}
+    services_dict = {}
+    entities = {entity_type: [] for entity_type in ENTITY_TABLES}
+    new_services = []
+    links = []
+    keys = []
+
+    def flush():
+        write_batch(cursor, entities, new_services, links)
+        cursor.executemany('INSERT INTO staged_keys VALUES (?, ?, ?, ?)', keys)
+        keys.clear()
+
+    if raw:
+        from csv_processor import read_export
+        records = source = read_export(csv_file)
+    else:
+        if csv_file == '-':
+            source = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            source = open_stream(csv_file, 'r', encoding='utf-8', newline='')
+        records = csv.reader(source)
+
+    row_count = 0
+    cursor.execute('BEGIN')
+    try:
+        with contextlib.closing(source):
+            parse = record_parser(next(records))
+
+            for record in records:
+                entity_type, values, services = parse(record)
+
+                last_ids[entity_type] += 1
+                entity_id = last_ids[entity_type]
+                entities[entity_type].append((entity_id,) + values)
+                keys.append((entity_type, f'{values[0]}\x1f{values[1]}', entity_id,
+                             content_hash(values, services)))
+
+                for service in services:
+                    if service not in services_dict:
+                        services_dict[service] = len(services_dict) + 1
+                        new_services.append((services_dict[service], service))
+                    links.append((entity_id, entity_type, services_dict[service]))
+
+                row_count += 1
+                if row_count % batch_size == 0:
+                    flush()
+                if row_count % chunk_size == 0:
+                    cursor.execute('COMMIT')
+                    cursor.execute('BEGIN')
+
+        flush()
+
+        # Number repeated keys in order of appearance, as natural_key does
+        cursor.execute('''
+        INSERT INTO entity_keys (entity_type, natural_key, entity_id, content_hash)
+        SELECT entity_type,
+               base_key || char(31) || ROW_NUMBER() OVER (
+                 PARTITION BY entity_type, base_key ORDER BY entity_id),
+               entity_id, content_hash
+        FROM staged_keys
+        ''')
+        cursor.execute('DROP TABLE staged_keys')
+
+        reuse_previous_ids(cursor, previous_tables)
+        index_start = time.perf_counter()
+        create_indexes(cursor)
+        derived_seconds = create_derived_tables(cursor, derived)
+        index_seconds = time.perf_counter() - index_start
+        cursor.execute('COMMIT')
+        record_full_build(cursor, previous_tables)
+    except BaseException:
+        conn.close()
+        os.remove(tmp_file)
+        raise
+
+    print_statistics(cursor)
+    conn.close()
+    os.replace(tmp_file, db_file)
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/sec)")
+    print(f"Peak memory: {peak_memory_mb():.1f} MB")
+
+    return {'rows': row_count, 'seconds': elapsed, 'index_seconds': index_seconds,
+            'derived_seconds': derived_seconds}
+
+def parse_partition(header, records):
+    """
+    Parse a partition of csv.reader records into (entity_type, values,
+    services, content_hash) tuples. Runs in a worker process.
+    """
+    parse = record_parser(header)
+    parsed = []
+    for record in records:
+        entity_type, values, services = parse(record)
+        parsed.append((entity_type, values, services, content_hash(values, services)))
+    return parsed
+
+def read_partitions(reader, partition_size):
+    """
+    Yield lists of up to partition_size records from a csv.reader
+    """
+    partition = []
+    for record in reader:
+        partition.append(record)
+        if len(partition) == partition_size:
+            yield partition
+            partition = []
+    if partition:
+        yield partition
+
+def parallel_load_database(csv_file, db_file, workers=None, partition_size=PARTITION_SIZE,
+                           derived=None):
+    """
+    Create a SQLite database from the given CSV file, parsing partitions of
+    the CSV on a process pool while this process does all the writing.
+    Partitions are consumed in file order, so ids come out the same as in
+    the other build modes.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    conn = sqlite3.connect(tmp_file, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.executescript(BULK_PRAGMAS)
+    cursor.executescript(SCHEMA)
+    previous_tables = attach_previous(cursor, db_file)
+
+    last_ids = {entity_type: 0 for entity_type in ENTITY_TABLES}
+    services_dict = {}
+    seen_keys = {}
+    row_count = 0
+
+    def write_partition(parsed):
+        entities = {entity_type: [] for entity_type in ENTITY_TABLES}
+        new_services = []
+        links = []
+        keys = []
+        for entity_type, values, services, digest in parsed:
+            last_ids[entity_type] += 1
+            entity_id = last_ids[entity_type]
+            entities[entity_type].append((entity_id,) + values)
+            keys.append((entity_type, natural_key(values, seen_keys), entity_id, digest))
+
+            for service in services:
+                if service not in services_dict:
+                    services_dict[service] = len(services_dict) + 1
+                    new_services.append((services_dict[service], service))
+                links.append((entity_id, entity_type, services_dict[service]))
+
+        write_batch(cursor, entities, new_services, links)
+        cursor.executemany('''
+        INSERT INTO entity_keys (entity_type, natural_key, entity_id, content_hash)
+        VALUES (?, ?, ?, ?)
+        ''', keys)
+        return len(parsed)
+
+    cursor.execute('BEGIN')
+    try:
+        with open_stream(csv_file, 'r', encoding='utf-8', newline='') as f, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            reader = csv.reader(f)
+            header = next(reader)
+
+            # Keep a bounded number of partitions in flight and write them
+            # back in submission order
+            pending = deque()
+            for partition in read_partitions(reader, partition_size):
+                pending.append(executor.submit(parse_partition, header, partition))
+                if len(pending) >= workers * 2:
+                    row_count += write_partition(pending.popleft().result())
+            while pending:
+                row_count += write_partition(pending.popleft().result())
+
+        reuse_previous_ids(cursor, previous_tables)
+        index_start = time.perf_counter()
+        create_indexes(cursor)
+        derived_seconds = create_derived_tables(cursor, derived)
+        index_seconds = time.perf_counter() - index_start
+        cursor.execute('COMMIT')
+        record_full_build(cursor, previous_tables)
+    except BaseException:
+        conn.close()
+        os.remove(tmp_file)
+        raise
+
+    print_statistics(cursor)
+    conn.close()
+    os.replace(tmp_file, db_file)
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {row_count} rows with {workers} workers in {elapsed:.2f}s "
+          f"({row_count / elapsed:,.0f} rows/sec)")
+
+    return {'rows': row_count, 'seconds': elapsed, 'index_seconds': index_seconds,
+            'derived_seconds': derived_seconds}
+
+def encode_database(db_file):
+    """
+    Rewrite a built database with dictionary-encoded columns. informasjonstype,
+    normeringsniva, status and ansvarlig move to lookup tables referenced by
+    integer ids, and eif_niva is split the same way as split_levels into the
+    eif_koblinger junction table plus a bitmask over eif_nivaer on each
+    row. The entity tables are replaced by
+    <table>_data tables, with views under the original names that decode
+    them, so readers keep working unchanged. Encoded databases are
+    read-only snapshots: update_database rebuilds them in full.
+    """
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    cursor = conn.cursor()
+    # Compact first so the sizes compare the encoding, not free pages left by the build
+    cursor.execute('VACUUM')
+    size_before = os.path.getsize(db_file)
+
+    cursor.execute('BEGIN')
+    try:
+        for column, lookup in DICTIONARY_COLUMNS.items():
+            # The values are distinct already, and the tables too small to need an index on them
+            cursor.execute(f'CREATE TABLE {lookup} (id INTEGER PRIMARY KEY, verdi TEXT NOT NULL)')
+            cursor.execute(f'''
+            INSERT INTO {lookup} (verdi)
+            SELECT {column} FROM reguleringer WHERE {column} IS NOT NULL
+            UNION
+            SELECT {column} FROM komponenter WHERE {column} IS NOT NULL
+            ORDER BY 1
+            ''')
+
+        # Known EIF levels get the low bits in their usual order
+        create_level_table(cursor)
+        cursor.execute('SELECT DISTINCT level FROM eif_levels')
+        levels = {level for level, in cursor.fetchall()}
+        ordered_levels = [level for level in EIF_LEVELS if level in levels]
+        ordered_levels += sorted(levels - set(EIF_LEVELS))
+
+        cursor.execute('''
+        CREATE TABLE eif_nivaer (
+          id INTEGER PRIMARY KEY,
+          navn TEXT NOT NULL,
+          bit INTEGER NOT NULL
+        )
+        ''')
+        cursor.executemany('INSERT INTO eif_nivaer (id, navn, bit) VALUES (?, ?, ?)',
+                           [(i + 1, level, 1 << i) for i, level in enumerate(ordered_levels)])
+
+        # Keyed by level first, so "all entities at a level" is a range scan
+        cursor.execute('''
+        CREATE TABLE eif_koblinger (
+          eif_niva_id INTEGER NOT NULL REFERENCES eif_nivaer(id),
+          entity_type TEXT NOT NULL,
+          entity_id INTEGER NOT NULL,
+          PRIMARY KEY (eif_niva_id, entity_type, entity_id)
+        ) WITHOUT ROWID
+        ''')
+        for entity_type, table in ENTITY_TABLES.items():
+            cursor.execute(f'''
+            INSERT INTO eif_koblinger (eif_niva_id, entity_type, entity_id)
+            SELECT n.id, '{entity_type}', e.id
+            FROM {table} e
+            JOIN eif_levels l ON l.eif_niva = e.eif_niva
+            JOIN eif_nivaer n ON n.navn = l.level
+            ''')
+
+        for table in ENTITY_TABLES.values():
+            cursor.execute(f'''
+            CREATE TABLE {table}_data (
+              id INTEGER PRIMARY KEY,
+              informasjonstype_id INTEGER REFERENCES informasjonstyper(id),
+              navn TEXT NOT NULL,
+              ingress TEXT,
+              beskrivelse TEXT,
+              kontekstavhengig_beskrivelse TEXT,
+              normeringsniva_id INTEGER REFERENCES normeringsnivaer(id),
+              eif_mask INTEGER NOT NULL DEFAULT 0,
+              status_id INTEGER REFERENCES statuser(id),
+              ansvarlig_id INTEGER REFERENCES ansvarlige(id),
+              referanse_lenketekst TEXT,
+              referanse_url TEXT
+            )
+            ''')
+            cursor.execute(f'''
+            INSERT INTO {table}_data
+            SELECT e.id,
+                   (SELECT id FROM informasjonstyper WHERE verdi = e.informasjonstype),
+                   e.navn, e.ingress, e.beskrivelse, e.kontekstavhengig_beskrivelse,
+                   (SELECT id FROM normeringsnivaer WHERE verdi = e.normeringsniva),
+                   (SELECT COALESCE(SUM(n.bit), 0) FROM eif_levels l
+                    JOIN eif_nivaer n ON n.navn = l.level
+                    WHERE l.eif_niva = e.eif_niva),
+                   (SELECT id FROM statuser WHERE verdi = e.status),
+                   (SELECT id FROM ansvarlige WHERE verdi = e.ansvarlig),
+                   e.referanse_lenketekst, e.referanse_url
+            FROM {table} e
+            ''')
+
+            # Dropping the table also drops its indexes and full-text triggers
+            cursor.execute(f'DROP TABLE {table}')
+            cursor.execute(f'''
+            CREATE VIEW {table} AS
+            SELECT d.id,
+                   informasjonstyper.verdi AS informasjonstype,
+                   d.navn, d.ingress, d.beskrivelse, d.kontekstavhengig_beskrivelse,
+                   normeringsnivaer.verdi AS normeringsniva,
+                   (SELECT group_concat(navn, ', ') FROM
+                     (SELECT navn FROM eif_nivaer WHERE d.eif_mask & bit ORDER BY bit)) AS eif_niva,
+                   statuser.verdi AS status,
+                   ansvarlige.verdi AS ansvarlig,
+                   d.referanse_lenketekst, d.referanse_url
+            FROM {table}_data d
+            LEFT JOIN informasjonstyper ON informasjonstyper.id = d.informasjonstype_id
+            LEFT JOIN normeringsnivaer ON normeringsnivaer.id = d.normeringsniva_id
+            LEFT JOIN statuser ON statuser.id = d.status_id
+            LEFT JOIN ansvarlige ON ansvarlige.id = d.ansvarlig_id
+            ''')
+
+        for statement in ENCODED_INDEXES:
+            cursor.execute(statement)
+
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        conn.close()
+        raise
+
+    cursor.execute('VACUUM')
+    conn.close()
+
+    size_after = os.path.getsize(db_file)
+    print(f"Encoded database: {size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB")
+
+def update_database(csv_file, db_file):
+    """
+    Bring an existing database in line with the given CSV file, touching only
+    the entities and koblinger that changed. Entities are matched on their
+    natural key and compared by content hash, and samhandlingstjeneter keep
+    their ids. New entities and services are numbered after the highest id
+    ever handed out, so they never take the id of a deleted one. Falls back
+    to a full bulk load if the database has no entity_keys table.
+    """
+    if not os.path.exists(db_file):
+        bulk_load_database(csv_file, db_file)
+        return
+
+    conn = sqlite3.connect(db_file, isolation_level=None, timeout=30)
+    cursor = conn.cursor()
+
+    if not table_exists(cursor, 'entity_keys'):
+        conn.close()
+        print("No entity_keys table found, doing a full rebuild")
+        bulk_load_database(csv_file, db_file)
+        return
+
+    if table_exists(cursor, 'eif_nivaer'):
+        conn.close()
+        print("Database is dictionary-encoded, doing a full rebuild")
+        bulk_load_database(csv_file, db_file)
+        encode_database(db_file)
+        return
+
+    existing = {
+        (entity_type, key): (entity_id, digest)
+        for entity_type, key, entity_id, digest in cursor.execute(
+            'SELECT entity_type, natural_key, entity_id, content_hash FROM entity_keys')
+    }
+    services_dict = dict(cursor.execute('SELECT name, id FROM samhandlingstjeneter'))
+    last_ids = read_last_ids(cursor)
+
+    def service_id(service):
+        if service not in services_dict:
+            last_ids['samhandlingstjeneste'] += 1
+            services_dict[service] = last_ids['samhandlingstjeneste']
+            cursor.execute('INSERT INTO samhandlingstjeneter (id, name) VALUES (?, ?)',
+                           (services_dict[service], service))
+        return services_dict[service]
+
+    placeholders = ', '.join('?' * len(ENTITY_COLUMNS))
+    assignments = ', '.join(f'{column} = ?' for column in ENTITY_COLUMNS)
+
+    inserted = updated = deleted = unchanged = 0
+    links_added = links_removed = 0
+    seen_keys = {}
+    # Samhandlingstjeneter whose overview must be rebuilt
+    affected_services = set()
+    # (entity_type, entity_id, operation, content_hash) for the changelog
+    changes = []
+
+    # Parse the CSV before taking the write lock to keep the transaction short
+    with open_stream(csv_file, 'r', encoding='utf-8', newline='') as f:
+        rows = [parse_row(row) for row in csv.DictReader(f)]
+
+    # BEGIN IMMEDIATE takes the write lock up front; readers keep seeing
+    # the old contents until COMMIT
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        for entity_type, values, services in rows:
+            table = ENTITY_TABLES[entity_type]
+            key = natural_key(values, seen_keys)
+            digest = content_hash(values, services)
+            current = existing.pop((entity_type, key), None)
+
+            if current is None:
+                last_ids[entity_type] += 1
+                entity_id = last_ids[entity_type]
+                cursor.execute(f'''
+                INSERT INTO {table} (id, {', '.join(ENTITY_COLUMNS)})
+                VALUES (?, {placeholders})
+                ''', (entity_id,) + values)
+                cursor.execute('''
+                INSERT INTO entity_keys (entity_type, natural_key, entity_id, content_hash)
+                VALUES (?, ?, ?, ?)
+                ''', (entity_type, key, entity_id, digest))
+                old_links = set()
+                changes.append((entity_type, entity_id, 'insert', digest))
+                inserted += 1
+            elif current[1] != digest:
+                entity_id = current[0]
+                cursor.execute(f'UPDATE {table} SET {assignments} WHERE id = ?', values + (entity_id,))
+                cursor.execute('''
+                UPDATE entity_keys SET content_hash = ?
+                WHERE entity_type = ? AND natural_key = ?
+                ''', (digest, entity_type, key))
+                cursor.execute('''
+                SELECT samhandlingstjeneste_id FROM koblinger
+                WHERE entity_id = ? AND entity_type = ?
+                ''', (entity_id, entity_type))
+                old_links = {linked_id for linked_id, in cursor.fetchall()}
+                changes.append((entity_type, entity_id, 'update', digest))
+                updated += 1
+            else:
+                unchanged += 1
+                continue
+
+            new_links = {service_id(service) for service in services}
+            for removed in old_links - new_links:
+                cursor.execute('''
+                DELETE FROM koblinger
+                WHERE entity_id = ? AND entity_type = ? AND samhandlingstjeneste_id = ?
+                ''', (entity_id, entity_type, removed))
+            for added in new_links - old_links:
+                cursor.execute('''
+                INSERT INTO koblinger (entity_id, entity_type, samhandlingstjeneste_id)
+                VALUES (?, ?, ?)
+                ''', (entity_id, entity_type, added))
+            links_added += len(new_links - old_links)
+            links_removed += len(old_links - new_links)
+            affected_services |= old_links | new_links
+
+        # Whatever is left in existing is no longer in the CSV
+        for (entity_type, key), (entity_id, old_digest) in existing.items():
+            cursor.execute(f'DELETE FROM {ENTITY_TABLES[entity_type]} WHERE id = ?', (entity_id,))
+            cursor.execute('''
+            DELETE FROM koblinger WHERE entity_id = ? AND entity_type = ?
+            RETURNING samhandlingstjeneste_id
+            ''', (entity_id, entity_type))
+            old_links = {linked_id for linked_id, in cursor.fetchall()}
+            links_removed += len(old_links)
+            affected_services |= old_links
+            cursor.execute('DELETE FROM entity_keys WHERE entity_type = ? AND natural_key = ?',
+                           (entity_type, key))
+            changes.append((entity_type, entity_id, 'delete', old_digest))
+            deleted += 1
+
+        # Drop services that are no longer linked to anything
+        cursor.execute('''
+        DELETE FROM samhandlingstjeneter
+        WHERE id NOT IN (SELECT samhandlingstjeneste_id FROM koblinger)
+        ''')
+
+        if table_exists(cursor, 'tjeneste_oversikt'):
+            # Overviews from before the entity columns were copied in are rebuilt in full
+            cursor.execute("SELECT 1 FROM pragma_table_info('tjeneste_oversikt') WHERE name = 'navn'")
+            refresh_service_overviews(cursor, affected_services if cursor.fetchone() else None)
+        # A changed entity moves its neighbours' rankings too, so rebuild it all
+        if affected_services and table_exists(cursor, 'relaterte_entiteter'):
+            build_related_entities(cursor)
+        if table_exists(cursor, 'metadata'):
+            write_last_ids(cursor, last_ids)
+            write_build_hash(cursor)
+        build_id = None
+        if table_exists(cursor, 'builds'):
+            build_id = record_build(cursor, 'incremental')
+            cursor.executemany('''
+            INSERT INTO changelog (build_id, entity_type, entity_id, operation, content_hash)
+            VALUES (?, ?, ?, ?, ?)
+            ''', [(build_id,) + change for change in changes])
+
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        conn.close()
+        raise
+
+    print(f"Database updated: {inserted} inserted, {updated} updated, "
+          f"{deleted} deleted, {unchanged} unchanged")
+    print(f"Koblinger: {links_added} added, {links_removed} removed")
+    if build_id is not None:
+        print(f"Recorded as build {build_id}")
+
+    conn.close()
+
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) != 3:
-        print("Usage: python csv_to_sqlite.py input.csv output.db")
-        sys.exit(1)
-    
-    csv_file = sys.argv[1]
-    db_file = sys.argv[2]
-    
-    create_database(csv_file, db_file)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the regulations SQLite database from a CSV file")
+    parser.add_argument('csv_file', help="UTF-8 CSV produced by csv_processor.py")
+    parser.add_argument('db_file', help="SQLite database to create")
+    parser.add_argument('--bulk', action='store_true',
+                        help="load with batched inserts in a single transaction")
+    parser.add_argument('--stream', action='store_true',
+                        help="stream the CSV with bounded memory; use - as csv_file to read stdin")
+    parser.add_argument('--raw', action='store_true',
+                        help="csv_file is a raw export in any encoding; convert and load it "
+                             "in one pass (implies --stream)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f"rows per transaction in stream mode (default {CHUNK_SIZE})")
+    parser.add_argument('--parallel', action='store_true',
+                        help="parse the CSV on a process pool with a single writer")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes in parallel mode (default: CPU count)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="update an existing database in place with only the changed rows")
+    parser.add_argument('--encoded', action='store_true',
+                        help="dictionary-encode low-cardinality columns after a full build")
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help="also export a columnar snapshot to DIR (needs pyarrow)")
+    parser.add_argument('--snapshot-format', choices=['parquet', 'arrow'], default='parquet',
+                        help="snapshot file format (default parquet)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"rows per executemany batch in bulk mode (default {BATCH_SIZE})")
+    parser.add_argument('--derived', nargs='*', choices=list(DERIVED_TABLES), default=list(DERIVED_TABLES),
+                        help="search index and precomputed tables to build in a full build "
+                             "(default all); give none to skip them")
+    args = parser.parse_args()
+
+    if args.raw:
+        if args.csv_file == '-':
+            parser.error("--raw needs a file, not stdin, to detect the encoding")
+        stream_database(args.csv_file, args.db_file, args.chunk_size, args.batch_size, raw=True,
+                        derived=args.derived)
+    elif args.stream:
+        stream_database(args.csv_file, args.db_file, args.chunk_size, args.batch_size,
+                        derived=args.derived)
+    elif args.parallel:
+        parallel_load_database(args.csv_file, args.db_file, args.workers, derived=args.derived)
+    elif args.incremental:
+        update_database(args.csv_file, args.db_file)
+    elif args.bulk:
+        bulk_load_database(args.csv_file, args.db_file, args.batch_size, derived=args.derived)
+    else:
+        create_database(args.csv_file, args.db_file, derived=args.derived)
+
+    if args.encoded and not args.incremental:
+        encode_database(args.db_file)
+
+    if args.snapshot:
+        from snapshot_export import export_snapshot
+        export_snapshot(args.db_file, args.snapshot, args.snapshot_format)
@@ -0,0 +1,29 @@
+import contextlib
+import csv
+import io
+
+import pytest
+
+import sqlite_builder
+
+CSV_COLUMNS = sqlite_builder.ENTITY_COLUMNS + ['samhandlingstjenester']
+
+def write_csv(path, rows):
+    """Write rows, dicts with any of CSV_COLUMNS, as a builder input CSV"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({column: row.get(column, '') for column in CSV_COLUMNS})
+
+@pytest.fixture
+def build_db(tmp_path):
+    """Build a database from rows with the given builder and return its path"""
+    def build(rows, builder=sqlite_builder.bulk_load_database, name='test'):
+        csv_file = tmp_path / f'{name}.csv'
+        db_file = tmp_path / f'{name}.sqlite'
+        write_csv(csv_file, rows)
+        with contextlib.redirect_stdout(io.StringIO()):
+            builder(str(csv_file), str(db_file))
+        return str(db_file)
+    return build
@@ -0,0 +1,22 @@
+import sqlite3
+
+import sqlite_builder
+
+ROWS = [
+    {'informasjonstype': 'Lov', 'navn': 'Pasientjournalloven', 'samhandlingstjenester': 'Kjernejournal'},
+    {'informasjonstype': 'Standard', 'navn': 'HL7 FHIR', 'samhandlingstjenester': 'Kjernejournal, E-resept'},
+]
+
+def build_hash(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT value FROM metadata WHERE key = 'build_hash'").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_same_data_same_hash_across_builders(build_db):
+    bulk = build_db(ROWS, name='bulk')
+    stream = build_db(ROWS, builder=sqlite_builder.stream_database, name='stream')
+    changed = build_db(ROWS[:1], name='changed')
+    assert build_hash(bulk) == build_hash(stream)
+    assert build_hash(bulk) != build_hash(changed)
@@ -0,0 +1,109 @@
+import contextlib
+import io
+import sqlite3
+
+import pytest
+
+import sqlite_builder
+from tests.conftest import write_csv
+
+ROWS = [
+    {'informasjonstype': 'Lov', 'navn': 'Pasientjournalloven', 'samhandlingstjenester': 'Kjernejournal'},
+    {'informasjonstype': 'Standard', 'navn': 'HL7 FHIR', 'samhandlingstjenester': 'Kjernejournal, E-resept'},
+    {'informasjonstype': 'Lov', 'navn': 'Reseptforskriften', 'samhandlingstjenester': 'E-resept'},
+]
+
+# A new row ahead of the others and a deleted one, so CSV order no longer
+# matches the ids of the first build
+CHANGED_ROWS = [
+    {'informasjonstype': 'Lov', 'navn': 'Helseregisterloven', 'samhandlingstjenester': 'Helsenorge'},
+] + ROWS[1:]
+
+def run(builder, *args):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        builder(*args)
+    return output.getvalue()
+
+def contents(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return (conn.execute('SELECT entity_type, natural_key, entity_id FROM entity_keys ORDER BY 1, 2').fetchall(),
+                conn.execute('SELECT id, name FROM samhandlingstjeneter ORDER BY id').fetchall(),
+                conn.execute("SELECT value FROM metadata WHERE key = 'build_hash'").fetchone()[0])
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize('builder', [
+    sqlite_builder.create_database,
+    sqlite_builder.bulk_load_database,
+    sqlite_builder.stream_database,
+    sqlite_builder.parallel_load_database,
+])
+def test_full_rebuild_keeps_ids(build_db, tmp_path, builder):
+    db_file = build_db(ROWS)
+    csv_file = str(tmp_path / 'changed.csv')
+    write_csv(csv_file, CHANGED_ROWS)
+    run(sqlite_builder.update_database, csv_file, db_file)
+    updated = contents(db_file)
+
+    output = run(builder, csv_file, db_file)
+    assert '0 inserted, 0 updated, 0 deleted' in output
+    assert contents(db_file) == updated
+
+def test_new_entities_do_not_reuse_deleted_ids(build_db, tmp_path):
+    db_file = build_db(ROWS)
+    csv_file = str(tmp_path / 'changed.csv')
+    write_csv(csv_file, CHANGED_ROWS)
+    output = run(sqlite_builder.bulk_load_database, csv_file, db_file)
+    assert '1 inserted, 0 updated, 1 deleted' in output
+
+    keys, services, _ = contents(db_file)
+    assert ('regulering', 'Lov\x1fHelseregisterloven\x1f1', 4) in keys
+    assert ('regulering', 'Lov\x1fReseptforskriften\x1f1', 3) in keys
+    assert services == [(1, 'Kjernejournal'), (2, 'E-resept'), (3, 'Helsenorge')]
+
+    # Id 4 is deleted, then the next new entity still gets a fresh id
+    write_csv(csv_file, ROWS[1:])
+    run(sqlite_builder.bulk_load_database, csv_file, db_file)
+    write_csv(csv_file, ROWS[1:] + [{'informasjonstype': 'Lov', 'navn': 'Biobankloven'}])
+    run(sqlite_builder.bulk_load_database, csv_file, db_file)
+    keys, _, _ = contents(db_file)
+    assert ('regulering', 'Lov\x1fBiobankloven\x1f1', 5) in keys
+
+def test_incremental_update_does_not_reuse_deleted_ids(build_db, tmp_path):
+    db_file = build_db(ROWS)
+    # Adds Helseregisterloven (id 4) and Helsenorge (service 3), then
+    # deletes everything but HL7 FHIR (id 2), so the highest ids are gone
+    csv_file = str(tmp_path / 'changed.csv')
+    write_csv(csv_file, CHANGED_ROWS)
+    run(sqlite_builder.update_database, csv_file, db_file)
+    write_csv(csv_file, ROWS[1:2])
+    run(sqlite_builder.update_database, csv_file, db_file)
+
+    write_csv(csv_file, ROWS[1:2] + [{'informasjonstype': 'Lov', 'navn': 'Biobankloven',
+                                      'samhandlingstjenester': 'Pasientens prøvesvar'}])
+    run(sqlite_builder.update_database, csv_file, db_file)
+    keys, services, _ = contents(db_file)
+    assert ('regulering', 'Lov\x1fBiobankloven\x1f1', 5) in keys
+    assert services == [(1, 'Kjernejournal'), (2, 'E-resept'), (4, 'Pasientens prøvesvar')]
+
+def test_full_rebuild_does_not_reuse_deleted_service_ids(build_db, tmp_path):
+    db_file = build_db(ROWS[1:] + CHANGED_ROWS[:1])
+    # Helsenorge, the highest service id, goes away and a new service comes in
+    csv_file = str(tmp_path / 'changed.csv')
+    write_csv(csv_file, ROWS[1:])
+    run(sqlite_builder.bulk_load_database, csv_file, db_file)
+    write_csv(csv_file, ROWS[1:] + [{'informasjonstype': 'Lov', 'navn': 'Biobankloven',
+                                     'samhandlingstjenester': 'Pasientens prøvesvar'}])
+    run(sqlite_builder.bulk_load_database, csv_file, db_file)
+
+    # An incremental update after the full builds still knows the marks
+    write_csv(csv_file, ROWS[1:2])
+    run(sqlite_builder.update_database, csv_file, db_file)
+    write_csv(csv_file, ROWS[1:2] + [{'informasjonstype': 'Lov', 'navn': 'Helseregisterloven',
+                                      'samhandlingstjenester': 'Helsenorge'}])
+    run(sqlite_builder.update_database, csv_file, db_file)
+    keys, services, _ = contents(db_file)
+    assert services == [(1, 'Kjernejournal'), (2, 'E-resept'), (5, 'Helsenorge')]
+    assert ('regulering', 'Lov\x1fHelseregisterloven\x1f1', 5) in keys
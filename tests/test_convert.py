@@ -0,0 +1,51 @@
+import contextlib
+import io
+import os
+import shutil
+
+import csv_processor
+
+EXPORT = os.path.join(os.path.dirname(__file__), '..', 'regulation_report.csv')
+
+def convert(input_file, output_dir, **kwargs):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        csv_processor.convert_batch([input_file], output_dir, workers=1, **kwargs)
+    return output.getvalue().splitlines()[-1]
+
+def test_batch_reconverts_when_columns_or_renames_change(tmp_path):
+    input_file = str(tmp_path / 'export.csv')
+    shutil.copy(EXPORT, input_file)
+    output_dir = str(tmp_path / 'out')
+
+    assert '1 converted' in convert(input_file, output_dir)
+    assert '1 skipped' in convert(input_file, output_dir)
+    assert '1 converted' in convert(input_file, output_dir, columns=['navn', 'status'])
+    assert '1 skipped' in convert(input_file, output_dir, columns=['navn', 'status'])
+    assert '1 converted' in convert(input_file, output_dir, columns=['navn', 'status'], rename={'navn': 'name'})
+    with open(tmp_path / 'out' / 'export.csv', encoding='utf-8') as f:
+        assert f.readline().strip() == 'name,status'
+
+# About 1 MB of ASCII rows, then a row with ø in cp1252
+HEADER = b'informasjonstype,navn\r\n'
+ASCII_ROWS = b'Lov,Pasientjournalloven\r\n' * 40000
+CP1252_ROW = 'Lov,Lov om behandlingsmåter\r\n'.encode('cp1252')
+
+def test_detect_encoding_falls_back_when_not_utf8(tmp_path):
+    # The detector stops on the ASCII start and reports ascii for a sample
+    # that is not valid UTF-8
+    input_file = tmp_path / 'export.csv'
+    input_file.write_bytes(HEADER + ASCII_ROWS + CP1252_ROW)
+    assert csv_processor.detect_encoding(str(input_file)) == (csv_processor.FALLBACK_ENCODING, 0.0)
+
+def test_convert_rereads_as_cp1252_after_the_sample(tmp_path):
+    # Only the first MB is sampled, so the file is taken as UTF-8
+    input_file = tmp_path / 'export.csv'
+    input_file.write_bytes(HEADER + ASCII_ROWS * 2 + CP1252_ROW)
+    output_file = tmp_path / 'out.csv'
+    with contextlib.redirect_stdout(io.StringIO()):
+        csv_processor.convert_csv(str(input_file), str(output_file), columns=['navn'])
+    lines = output_file.read_text(encoding='utf-8').splitlines()
+    assert len(lines) == 80002
+    assert lines[-1] == 'Lov om behandlingsmåter'
+    assert lines[-2] == 'Pasientjournalloven'
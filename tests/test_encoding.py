@@ -0,0 +1,77 @@
+import contextlib
+import io
+import sqlite3
+
+import pytest
+
+import sqlite_builder
+from regulation_queries import RegulationQueries
+
+ROWS = [
+    {'informasjonstype': 'Standard', 'navn': 'HL7 FHIR', 'eif_niva': 'Organisatorisk,Semantisk',
+     'samhandlingstjenester': 'Kjernejournal'},
+    {'informasjonstype': 'Lov', 'navn': 'Pasientjournalloven', 'eif_niva': 'Juridisk, Organisatorisk',
+     'samhandlingstjenester': 'Kjernejournal'},
+    {'informasjonstype': 'Lov', 'navn': 'Reseptforskriften', 'samhandlingstjenester': 'E-resept'},
+]
+
+@pytest.fixture
+def encoded_db(build_db):
+    db_file = build_db(ROWS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_builder.encode_database(db_file)
+    return db_file
+
+def names(entities):
+    return [entity.navn for entity in entities]
+
+def test_levels_without_spaces_are_encoded(encoded_db):
+    conn = sqlite3.connect(encoded_db)
+    try:
+        rows = dict(conn.execute('SELECT navn, eif_niva FROM reguleringer'))
+    finally:
+        conn.close()
+    assert rows == {
+        'HL7 FHIR': 'Organisatorisk, Semantisk',
+        'Pasientjournalloven': 'Juridisk, Organisatorisk',
+        'Reseptforskriften': None,
+    }
+
+def test_entities_with_levels(encoded_db):
+    queries = RegulationQueries(encoded_db)
+    assert names(queries.entities_with_levels(['Semantisk'])) == ['HL7 FHIR']
+    assert names(queries.entities_with_levels(['Organisatorisk', 'Semantisk'])) == ['HL7 FHIR']
+    assert names(queries.entities_with_levels(['Juridisk', 'Semantisk'], match_all=False)) == [
+        'HL7 FHIR', 'Pasientjournalloven']
+
+@pytest.mark.parametrize('levels', [[], ['Bogus'], ['Semantisk', 'Bogus']])
+def test_entities_with_unknown_or_no_levels(encoded_db, levels):
+    with pytest.raises(ValueError):
+        RegulationQueries(encoded_db).entities_with_levels(levels)
+
+@pytest.mark.parametrize('encode', [False, True])
+def test_filter_by_level_splits_like_the_builder(build_db, encode):
+    db_file = build_db(ROWS + [{'informasjonstype': 'Lov', 'navn': 'Wildcard', 'eif_niva': 'Se%'}])
+    if encode:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sqlite_builder.encode_database(db_file)
+    queries = RegulationQueries(db_file)
+    assert names(queries.filter_by_status_and_level(eif_niva='Semantisk')) == ['HL7 FHIR']
+    assert names(queries.filter_by_status_and_level(eif_niva='Organisatorisk')) == [
+        'HL7 FHIR', 'Pasientjournalloven']
+    assert names(queries.filter_by_status_and_level(eif_niva='Se%')) == ['Wildcard']
+    assert names(queries.filter_by_status_and_level(eif_niva='%')) == []
+
+def test_levels_are_kept_in_a_junction_table(encoded_db):
+    conn = sqlite3.connect(encoded_db)
+    try:
+        rows = conn.execute('''
+        SELECT e.navn, n.navn FROM eif_koblinger k
+        JOIN eif_nivaer n ON n.id = k.eif_niva_id
+        JOIN reguleringer e ON e.id = k.entity_id AND k.entity_type = 'regulering'
+        ORDER BY 1, 2
+        ''').fetchall()
+    finally:
+        conn.close()
+    assert rows == [('HL7 FHIR', 'Organisatorisk'), ('HL7 FHIR', 'Semantisk'),
+                    ('Pasientjournalloven', 'Juridisk'), ('Pasientjournalloven', 'Organisatorisk')]
@@ -0,0 +1,47 @@
+import contextlib
+import io
+import json
+
+import sqlite_builder
+from regulation_queries import RegulationQueries
+from tests.conftest import write_csv
+
+ROWS = [
+    {'informasjonstype': 'Lov', 'navn': 'Pasientjournalloven', 'eif_niva': 'Juridisk',
+     'samhandlingstjenester': 'Kjernejournal, E-resept'},
+    {'informasjonstype': 'Standard', 'navn': 'HL7 FHIR', 'eif_niva': 'Organisatorisk,Semantisk',
+     'samhandlingstjenester': 'Kjernejournal'},
+    {'informasjonstype': 'Lov', 'navn': 'Reseptforskriften', 'samhandlingstjenester': 'E-resept'},
+]
+
+def overview(db_file, service):
+    result = RegulationQueries(db_file).service_overview(service)
+    return result and json.loads(result)
+
+def groups(result):
+    return [(group['informasjonstype'], group['eif_niva'], [e['navn'] for e in group['elementer']])
+            for group in result['grupper']]
+
+def test_entity_listed_under_each_level(build_db):
+    db_file = build_db(ROWS)
+    assert groups(overview(db_file, 'Kjernejournal')) == [
+        ('Lov', 'Juridisk', ['Pasientjournalloven']),
+        ('Standard', 'Organisatorisk', ['HL7 FHIR']),
+        ('Standard', 'Semantisk', ['HL7 FHIR']),
+    ]
+    assert overview(db_file, 'Ukjent') is None
+
+def test_incremental_update_refreshes_overview(build_db, tmp_path):
+    db_file = build_db(ROWS)
+    csv_file = tmp_path / 'update.csv'
+    write_csv(csv_file, [dict(ROWS[0], ingress='Ny ingress')] + ROWS[1:2] + [dict(ROWS[2], eif_niva='Teknisk')])
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_builder.update_database(str(csv_file), db_file)
+    assert groups(overview(db_file, 'E-resept')) == [
+        ('Lov', 'Juridisk', ['Pasientjournalloven']),
+        ('Lov', 'Teknisk', ['Reseptforskriften']),
+    ]
+    # Entity columns are copied into the overview, so they follow updates too
+    element = overview(db_file, 'Kjernejournal')['grupper'][0]['elementer'][0]
+    assert element['ingress'] == 'Ny ingress'
+    assert element['eif_niva'] == 'Juridisk'
@@ -0,0 +1,42 @@
+import random
+
+from regulation_queries import RegulationQueries
+
+# Felles is linked to every entity, more than RELATED_MAX_SERVICE_SHARE of them
+ROWS = [
+    {'informasjonstype': 'Lov', 'navn': 'A', 'samhandlingstjenester': 'Felles, Kjernejournal, E-resept'},
+    {'informasjonstype': 'Lov', 'navn': 'B', 'samhandlingstjenester': 'Felles, Kjernejournal, E-resept'},
+    {'informasjonstype': 'Lov', 'navn': 'C', 'samhandlingstjenester': 'Felles, Kjernejournal'},
+    {'informasjonstype': 'Lov', 'navn': 'D', 'samhandlingstjenester': 'Felles, E-resept, Helsenorge'},
+    {'informasjonstype': 'Lov', 'navn': 'E', 'samhandlingstjenester': 'Felles, Helsenorge'},
+    {'informasjonstype': 'Lov', 'navn': 'F', 'samhandlingstjenester': 'Felles'},
+]
+
+def related(queries, entity_id, limit=10):
+    return [(entity.navn, entity.shared_services, round(entity.jaccard, 3))
+            for entity in queries.related_entities('regulering', entity_id, limit)]
+
+def test_related_entities(build_db):
+    queries = RegulationQueries(build_db(ROWS))
+    # Felles counts as shared, but sharing only Felles does not relate E and F
+    assert related(queries, 1) == [('B', 3, 1.0), ('C', 2, 0.667), ('D', 2, 0.5)]
+    assert related(queries, 2) == [('A', 3, 1.0), ('C', 2, 0.667), ('D', 2, 0.5)]
+    assert related(queries, 5) == [('D', 2, 0.667)]
+    assert related(queries, 6) == []
+    assert related(queries, 1, limit=1) == [('B', 3, 1.0)]
+
+def test_related_entities_with_many_services(build_db):
+    # Rows linking up to 24 services, checked against ranking every pair
+    rng = random.Random(0)
+    services = ['Felles'] + [f'Tjeneste {i}' for i in range(30)]
+    linked = [{'Felles'} | set(rng.sample(services[1:], rng.choice([1, 2, 3, 12, 24]))) for _ in range(40)]
+    queries = RegulationQueries(build_db([
+        {'informasjonstype': 'Lov', 'navn': str(i), 'samhandlingstjenester': ', '.join(sorted(names))}
+        for i, names in enumerate(linked, 1)
+    ]))
+    for i, names in enumerate(linked, 1):
+        expected = sorted(
+            (-len(names & other), len(other), j, len(names & other), round(len(names & other) / len(names | other), 3))
+            for j, other in enumerate(linked, 1) if j != i and names & other - {'Felles'}
+        )
+        assert related(queries, i) == [(str(j), shared, jaccard) for _, _, j, shared, jaccard in expected[:10]]
@@ -0,0 +1,22 @@
+import regulation_search
+
+ROWS = [
+    {'informasjonstype': 'Krav og prinsipper', 'navn': 'Prøvesvar fra laboratorium',
+     'samhandlingstjenester': 'Pasientens prøvesvar'},
+    {'informasjonstype': 'Lov', 'navn': 'Endringer gjennom året', 'samhandlingstjenester': 'A'},
+    {'informasjonstype': 'Lov', 'navn': 'Arkivloven', 'samhandlingstjenester': 'A'},
+]
+
+def names(db_file, text):
+    conn = regulation_search.connect(db_file)
+    try:
+        return sorted(hit['navn'] for hit in regulation_search.search(conn, text))
+    finally:
+        conn.close()
+
+def test_norwegian_letters_are_distinct(build_db):
+    db_file = build_db(ROWS)
+    assert names(db_file, 'prøvesvar') == ['Prøvesvar fra laboratorium']
+    assert names(db_file, 'provesvar') == []
+    assert names(db_file, 'året') == ['Endringer gjennom året']
+    assert names(db_file, 'ar') == ['Arkivloven']